@@ -0,0 +1,27 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w", fsync: bool = False, opener=open, **kwargs):
+    """Write `path` through a temporary file swapped in only once it is complete.
+
+    An interrupted write leaves the last good file in place rather than a
+    truncated one. `opener` (e.g. gzip.open) and `kwargs` open the temporary
+    file; `fsync` forces it to disk before the swap, for files that other data
+    is dropped in favor of right after.
+    """
+    tmp = path + ".tmp"
+    try:
+        with opener(tmp, mode, **kwargs) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,439 @@
+"""Benchmarks for the bot's hot paths.
+
+    python bench.py [--sizes 10,100,1000,10000,100000] [--out bench_results.json]
+                    [--baseline old_results.json] [--tolerance 0.25] [--replay feeds.snap.gz]
+
+Runs offline: feeds come from a local HTTP server and messages go to
+fake_twilio.py, so nothing is really sent. Results (seconds,
+best of a few runs) are written as JSON to --out; with --baseline, every
+result is compared against an earlier file and the run exits non-zero when a
+hot path got slower by more than --tolerance, or when a budget check fails.
+With --replay, recorded feed history (see snapshots.py) is also fed through
+fetch_feed poll by poll, and what it picked out is compared too.
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+import http.server
+import hashlib
+import urllib.request
+from contextlib import contextmanager, redirect_stdout
+from email.utils import formatdate
+
+from fake_twilio import FakeTwilio
+from localserver import LocalServer
+from htmlscan import first_image, summarize
+from snapshots import ReplayServer, SnapshotArchive
+
+MB = 1024 * 1024
+# `import script` must stay under this, and must not pull in the send-only dependencies
+# or the heavy stdlib modules only a fetch or a send needs
+IMPORT_BUDGET = 0.100
+LAZY_MODULES  = ("twilio", "feedparser", "dotenv", "asyncio", "concurrent.futures",
+                 "urllib.request", "xml.etree.ElementTree", "sqlite3")
+# differences below this are noise, whatever the ratio
+NOISE_FLOOR   = 0.002
+
+
+def legacy_extract_image(html: str):
+    # the <img> fallback _extract_image used before htmlscan
+    m = re.search(r'<img[^>]+src="([^">]+)"', html)
+    return m.group(1) if m else None
+
+
+def pathological_summaries(size: int = MB) -> dict:
+    """Summaries built to make a backtracking tag regex go quadratic."""
+    return {
+        "img_no_close":   ("<img " * (size // 5))[:size],
+        "img_no_src":     ("<img a>" * (size // 7))[:size],
+        "unclosed_quote": '<img src="' + "x" * (size - 10),
+        "open_brackets":  "<" * size,
+        "long_text":      "<p>" + "lorem ipsum dolor " * (size // 18) + '</p><img src="end.jpg">',
+    }
+
+
+def synthetic_feed(n: int, seed: int = 0) -> bytes:
+    """An RSS 2.0 feed of `n` entries, newest first, shaped like a real news feed:
+    a third of the titles pass the default keyword filter, summaries are a few
+    hundred bytes of HTML with an inline image, and half the entries carry a
+    media:thumbnail."""
+    rnd   = random.Random(seed)
+    now   = time.time()
+    words = "studio staff cast trailer visual key announced streaming winter summer".split()
+    kinds = ("Anime episode {} premiere", "Manga volume {} goes on sale", "Studio interview part {}")
+    items = []
+    for i in range(n):
+        text  = " ".join(rnd.choice(words) for _ in range(60))
+        thumb = f'<media:thumbnail url="https://img.example.com/thumb/{i}.jpg"/>' if i % 2 else ""
+        items.append(
+            f"<item><title>{kinds[i % 3].format(i)}</title>"
+            f"<link>https://news.example.com/{i}</link><guid>bench-{i}</guid>"
+            f"<pubDate>{formatdate(now - i * 600)}</pubDate>"
+            f"<description><![CDATA[<p>{text} &amp; <b>more</b></p>"
+            f'<img src="https://img.example.com/inline/{i}.jpg" alt="key visual"><p>{text[:120]}</p>]]>'
+            f"</description>{thumb}</item>"
+        )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/"><channel>'
+            f'<title>bench</title>{"".join(items)}</channel></rss>').encode("utf-8")
+
+
+class _FeedHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.feeds.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the bot hangs up once it reaches entries it has already seen
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def serve(handler, **attrs):
+    """Run `handler` on a local port for the duration; yields the base URL."""
+    with LocalServer(handler, **attrs) as server:
+        yield server.base_url
+
+
+@contextmanager
+def scratch_dir():
+    """The bot keeps its state in the working directory; give each measurement a fresh one."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench-") as path:
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(cwd)
+
+
+def timed(fn, *args, limit: float = 10.0):
+    """Seconds for one call, or None once a call has run past `limit` seconds
+    (measured afterwards: the legacy regex cannot be interrupted)."""
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    return None if elapsed > limit else elapsed
+
+
+def best_of(fn, repeat: int) -> float:
+    """Fastest of `repeat` calls to `fn()`, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def repeats(n: int, most: int = 20) -> int:
+    # small inputs are cheap and noisy: run them more often
+    return max(1, min(most, 20_000 // max(n, 1)))
+
+
+@contextmanager
+def quiet():
+    """Swallow the bot's progress output so it does not break up the result tables."""
+    with redirect_stdout(io.StringIO()):
+        yield
+
+
+def make_bot(feed_urls):
+    import script
+    return script.WhatsAppRSSBot(feed_urls)
+
+
+def feed_entries(url: str) -> list:
+    """Every entry of the feed at `url`, parsed the way fetch_feed parses it."""
+    import script
+    with urllib.request.urlopen(url) as resp:
+        return list(script.FeedStream(resp))
+
+
+def bench_image_extraction(size: int = MB) -> dict:
+    # the legacy pattern is quadratic on these; it only gets 1/16 of the input so it finishes
+    small   = size // 16
+    results = {}
+    print(f"image extraction on pathological summaries ({size // 1024} KiB / {small // 1024} KiB)")
+    print(f"{'case':<16}{'scanner':>12}{'scanner 1/16':>15}{'legacy 1/16':>15}")
+    for name, html in pathological_summaries(size).items():
+        full   = timed(first_image, html)
+        part   = timed(first_image, html[:small])
+        legacy = timed(legacy_extract_image, html[:small])
+        results[f"pathological/first_image/{name}"] = full
+        legacy = f"{legacy * 1000:>12.2f} ms" if legacy is not None else f"{'gave up':>15}"
+        print(f"{name:<16}{full * 1000:>9.2f} ms{part * 1000:>12.2f} ms{legacy}")
+    return results
+
+
+def bench_summarize(size: int = MB) -> dict:
+    results = {}
+    print(f"\nsummary + image in one pass on {size // 1024} KiB summaries")
+    for name, html in pathological_summaries(size).items():
+        results[f"pathological/summarize/{name}"] = elapsed = timed(summarize, html, 200)
+        print(f"{name:<16}{elapsed * 1000:>9.2f} ms")
+    return results
+
+
+def bench_pipeline(sizes) -> dict:
+    """fetch_feed (from a cold state, and again with every entry already seen),
+    _clean_summary and _extract_image on synthetic feeds of each size."""
+    results = {}
+    print(f"\n{'entries':>8}{'fetch cold':>14}{'fetch known':>14}{'clean':>12}{'image':>12}")
+    for n in sizes:
+        with serve(_FeedHandler, feeds={"/feed": synthetic_feed(n)}) as base, scratch_dir():
+            url = base + "/feed"
+
+            def cold():
+                with scratch_dir():
+                    bot = make_bot(url)
+                    bot.fetch_feed()
+                    bot.close()
+
+            with quiet():
+                fetch_cold = best_of(cold, repeats(n, 3))
+                # with every entry seen, the stream should stop after SEEN_RUN_LIMIT entries
+                bot = make_bot(url)
+                for item in bot.fetch_feed():
+                    bot.state.add(item.uid)
+                bot.state.flush()
+                bot.validators.clear()
+                fetch_known = best_of(bot.fetch_feed, repeats(n))
+
+            entries = feed_entries(url)
+            clean   = best_of(lambda: [bot._clean_summary(e.get("summary", "")) for e in entries], repeats(n, 5))
+            image   = best_of(lambda: [bot._extract_image(e) for e in entries], repeats(n, 5))
+            bot.close()
+
+        results.update({f"fetch_feed/cold/{n}": fetch_cold, f"fetch_feed/known/{n}": fetch_known,
+                        f"clean_summary/{n}": clean, f"extract_image/{n}": image})
+        print(f"{n:>8}{fetch_cold * 1000:>11.1f} ms{fetch_known * 1000:>11.2f} ms"
+              f"{clean * 1000:>9.1f} ms{image * 1000:>9.1f} ms")
+    return results
+
+
+def bench_seen_state(sizes, backends=("file", "hashed", "sqlite")) -> dict:
+    """Saving n new seen IDs, reopening the store, and looking all n up again."""
+    from state import open_state
+    results = {}
+    print(f"\n{'seen IDs':>8}{'backend':>9}{'save':>12}{'load':>12}{'lookup':>12}")
+    for n in sizes:
+        uids = [f"https://news.example.com/{i}" for i in range(n)]
+        for backend in backends:
+            with scratch_dir():
+                store = open_state(backend)
+                start = time.perf_counter()
+                for uid in uids:
+                    store.add(uid)
+                store.flush()
+                save  = time.perf_counter() - start
+                store.close()
+
+                start  = time.perf_counter()
+                store  = open_state(backend)
+                load   = time.perf_counter() - start
+                lookup = best_of(lambda: all(uid in store for uid in uids), repeats(n, 3))
+                store.close()
+            results.update({f"seen/{backend}/save/{n}": save, f"seen/{backend}/load/{n}": load,
+                            f"seen/{backend}/lookup/{n}": lookup})
+            print(f"{n:>8}{backend:>9}{save * 1000:>9.1f} ms{load * 1000:>9.1f} ms{lookup * 1000:>9.1f} ms")
+    return results
+
+
+def bench_run(sizes) -> dict:
+    """End-to-end run() from a cold state against the fake Messages API: fetch,
+    filter, summarize, queue, and send up to the quota."""
+    results = {}
+    print(f"\n{'entries':>8}{'run()':>12}")
+    for n in sizes:
+        feeds = {"/feed": synthetic_feed(n)}
+        with serve(_FeedHandler, feeds=feeds) as base, FakeTwilio() as api, scratch_dir():
+            os.environ["TWILIO_API_BASE_URL"] = api.base_url
+            bot = make_bot(base + "/feed")
+            with quiet():
+                start = time.perf_counter()
+                bot.run()
+                elapsed = time.perf_counter() - start
+                bot.close()
+        results[f"run/{n}"] = elapsed
+        print(f"{n:>8}{elapsed * 1000:>9.1f} ms")
+    return results
+
+
+# provider conditions for the sender benchmark: FakeTwilio settings
+SEND_SCENARIOS = {
+    "clean":     {"latency": 0.05, "jitter": 0.02},
+    "throttled": {"latency": 0.05, "jitter": 0.02, "max_rate": 20},
+    "flaky":     {"latency": 0.05, "jitter": 0.02, "error_rate": 0.1},
+}
+
+
+def bench_sender(messages: int = 100) -> dict:
+    """Throughput of the bot's AsyncSender, retries and backoff included, under
+    each of SEND_SCENARIOS."""
+    import script
+    results = {}
+    print(f"\n{messages} sends{'time':>14}{'msg/s':>9}{'sent':>7}{'failed':>8}{'429s':>7}{'5xx':>6}")
+    for name, conditions in SEND_SCENARIOS.items():
+        outcome = {"sent": 0, "failed": 0}
+
+        def on_result(job, sid, error):
+            outcome["failed" if error else "sent"] += 1
+
+        with FakeTwilio(seed=0, **conditions) as api, scratch_dir():
+            os.environ["TWILIO_API_BASE_URL"] = api.base_url
+            bot  = make_bot("http://127.0.0.1:9/unused")
+            jobs = [script.Delivery(bot.to_whatsapp, f"bench {i}", f"https://news.example.com/{i}", f"message {i}")
+                    for i in range(messages)]
+            with quiet():
+                start = time.perf_counter()
+                bot.sender.run(jobs, on_result)
+                elapsed = time.perf_counter() - start
+                bot.close()
+            stats = dict(api.stats)
+        results[f"send/{name}/{messages}"] = elapsed
+        print(f"{name:<12}{elapsed * 1000:>11.0f} ms{messages / elapsed:>9.1f}{outcome['sent']:>7}"
+              f"{outcome['failed']:>8}{stats['throttled']:>7}{stats['errors']:>6}")
+    return results
+
+
+def bench_replay(path: str) -> tuple:
+    """Every recorded poll in the archive at `path`, replayed through fetch_feed as
+    fast as it goes, from a cold state. Returns (results, what was picked out)."""
+    archive = SnapshotArchive.load(path)
+    times   = archive.times()
+    titles  = []
+    elapsed = 0.0
+    with ReplayServer(archive, speed=None) as replay, scratch_dir():
+        bot = make_bot([replay.url_for(url) for url in archive.urls])
+        # judge entries by the recorded moment, not by how old the recording is now
+        bot.seen_ttl = None
+        with quiet():
+            for when in times:
+                replay.seek(when)
+                start = time.perf_counter()
+                for item in bot.fetch_feed():
+                    titles.append(item.title)
+                    bot.state.add(item.uid)
+                bot.state.flush()
+                bot.rejected.flush()
+                elapsed += time.perf_counter() - start
+            bot.close()
+    picked = {"polls": len(times), "new_items": len(titles),
+              "titles_sha1": hashlib.sha1("\n".join(titles).encode("utf-8")).hexdigest()}
+    print(f"\nreplay of {len(archive.urls)} feed(s), {len(times)} polls over "
+          f"{(times[-1] - times[0]) / 3600 if times else 0:.1f} h: {elapsed * 1000:.1f} ms, "
+          f"{len(titles)} new item(s)")
+    return {"replay/fetch_feed": elapsed}, picked
+
+
+def bench_import(runs: int = 5) -> tuple:
+    """Import time of script.py in a fresh interpreter (best of `runs`), checked
+    against IMPORT_BUDGET. Returns (seconds, within budget?)."""
+    code = "import script, sys; print(','.join(m for m in %r if m in sys.modules))" % (LAZY_MODULES,)
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                             capture_output=True, text=True, check=True, cwd=here)
+        # the last "import time:" line is the outermost import: "... | cumulative us | script"
+        cumulative = int([line for line in out.stderr.splitlines() if line.endswith("| script")][-1].split("|")[1])
+        best = cumulative if best is None else min(best, cumulative)
+    eager = out.stdout.strip()
+    ok    = best / 1e6 <= IMPORT_BUDGET and not eager
+    print(f"\nimport script: {best / 1000:.1f} ms (budget {IMPORT_BUDGET * 1000:.0f} ms)"
+          + (f", imported eagerly: {eager}" if eager else "") + (" OK" if ok else " OVER BUDGET"))
+    return best / 1e6, ok
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Print each result next to its baseline; returns the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':<40}{'baseline':>12}{'now':>12}{'change':>9}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None or now is None:
+            continue
+        change = now / before - 1 if before else 0.0
+        slower = change > tolerance and now - before > NOISE_FLOOR
+        if slower:
+            regressions.append(name)
+        print(f"{name:<40}{before * 1000:>9.2f} ms{now * 1000:>9.2f} ms{change:>+9.0%}"
+              + ("  REGRESSION" if slower else ""))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for the bot's hot paths.")
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000",
+                        help="comma-separated feed sizes (entries) to benchmark")
+    parser.add_argument("--out", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown against the baseline that counts as a regression (default: 0.25)")
+    parser.add_argument("--replay", help="feed snapshot archive (snapshots.py record) to replay through fetch_feed")
+    args  = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    out   = os.path.abspath(args.out)
+
+    # never reach the real Twilio account or the deployment's state, whatever .env says
+    os.environ.update({"TWILIO_ACCOUNT_SID": "AC" + "0" * 32, "TWILIO_AUTH_TOKEN": "bench",
+                       "TWILIO_WHATSAPP_FROM": "whatsapp:+10000000000",
+                       "TWILIO_WHATSAPP_TO": "whatsapp:+10000000001",
+                       "SEND_RATE": "1000", "STATE_BACKEND": "file"})
+    for name in ("SEEN_FILTER", "DIGEST_MODE", "SEND_SPREAD", "VALIDATE_IMAGES",
+                 "SUBSCRIBERS_FILE", "FILTER_KEYWORDS_FILE"):
+        os.environ.pop(name, None)
+
+    import_time, import_ok = bench_import()
+    results = {"import/script": import_time}
+    results.update(bench_image_extraction())
+    results.update(bench_summarize())
+    results.update(bench_pipeline(sizes))
+    results.update(bench_seen_state(sizes))
+    results.update(bench_run(sizes))
+    results.update(bench_sender())
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "created": time.time(), "results": results}
+    if args.replay:
+        replay_results, report["replay"] = bench_replay(args.replay)
+        results.update(replay_results)
+
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {out}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        if "replay" in report and baseline.get("replay", {}).get("polls") == report["replay"]["polls"] \
+                and baseline["replay"]["titles_sha1"] != report["replay"]["titles_sha1"]:
+            print(f"replay picked out different items than the baseline "
+                  f"({baseline['replay']['new_items']} before, {report['replay']['new_items']} now)")
+    return 1 if regressions or not import_ok else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
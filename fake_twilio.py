@@ -0,0 +1,145 @@
+"""A local stand-in for the Twilio Messages API, for load tests and hermetic runs.
+
+    python fake_twilio.py [--port 8099] [--latency 0.2] [--jitter 0.05]
+                          [--error-rate 0.01] [--throttle-rate 0.02] [--max-rate 10]
+
+then point the bot at it with TWILIO_API_BASE_URL=http://127.0.0.1:8099.
+
+Only "create a message" is implemented. Answers look like Twilio's, including
+its JSON error bodies, so the real client library parses them as usual.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import http.server
+from email.utils import formatdate
+from typing import Optional
+from urllib.parse import parse_qs
+
+from localserver import LocalServer
+from sender import TokenBucket
+
+
+class _MessagesHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        fake  = self.server.fake
+        parts = self.path.split("?")[0].strip("/").split("/")
+        form  = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        # /2010-04-01/Accounts/{AccountSid}/Messages.json
+        if len(parts) != 4 or parts[0] != "2010-04-01" or parts[1] != "Accounts" or parts[3] != "Messages.json":
+            return self._error(404, 20404, "The requested resource was not found")
+        status, retry_after = fake.admit()
+        if status == 429:
+            return self._error(429, 20429, "Too Many Requests", {"Retry-After": str(retry_after)})
+        if status >= 500:
+            return self._error(status, 20500, "Internal Server Error")
+        if not form.get("To") or not (form.get("Body") or form.get("MediaUrl")):
+            return self._error(400, 21602, "Message body is required")
+        self._reply(201, fake.accept(parts[2], form))
+
+    def _error(self, status: int, code: int, message: str, headers: Optional[dict] = None):
+        self._reply(status, {"code": code, "message": message, "status": status,
+                             "more_info": f"https://www.twilio.com/docs/errors/{code}"}, headers)
+
+    def _reply(self, status: int, payload: dict, headers: Optional[dict] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTwilio(LocalServer):
+    """Serves the Messages create endpoint on 127.0.0.1.
+
+    Each request takes `latency` seconds, give or take up to `jitter`. A request
+    fails with a 5xx at random with probability `error_rate`, and is throttled
+    (429 with Retry-After) with probability `throttle_rate`. With `max_rate`,
+    requests beyond that many per second are also throttled, as a real account's
+    rate limit would. Accepted messages are kept in `messages`; `stats` counts
+    every outcome.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, max_rate: Optional[float] = None,
+                 retry_after: int = 1, seed: Optional[int] = None, verbose: bool = False):
+        super().__init__(_MessagesHandler, port, fake=self)
+        self.latency       = latency
+        self.jitter        = jitter
+        self.error_rate    = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after   = retry_after
+        self.verbose       = verbose
+        self.random        = random.Random(seed)
+        self.bucket        = TokenBucket(max_rate, max(1, int(max_rate))) if max_rate else None
+        self.lock          = threading.Lock()
+        self.messages      = []
+        self.stats         = {"accepted": 0, "errors": 0, "throttled": 0}
+
+    def admit(self):
+        """Waits out the simulated latency and decides the outcome: (HTTP status, Retry-After)."""
+        with self.lock:
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll  = self.random.random()
+        time.sleep(delay)
+        with self.lock:
+            if roll < self.throttle_rate or (self.bucket and not self.bucket.try_acquire()):
+                self.stats["throttled"] += 1
+                return 429, self.retry_after
+            if roll < self.throttle_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return self.random.choice((500, 502, 503)), None
+            return 201, None
+
+    def accept(self, account_sid: str, form: dict) -> dict:
+        sid = "SM" + uuid.uuid4().hex
+        now = formatdate(usegmt=True)
+        message = {
+            "sid": sid, "account_sid": account_sid, "api_version": "2010-04-01",
+            "to": form["To"][0], "from": form.get("From", [None])[0], "body": form.get("Body", [""])[0],
+            "num_media": str(len(form.get("MediaUrl", []))), "num_segments": "1",
+            "status": "queued", "direction": "outbound-api", "price": None, "price_unit": "USD",
+            "error_code": None, "error_message": None,
+            "date_created": now, "date_updated": now, "date_sent": None,
+            "uri": f"/2010-04-01/Accounts/{account_sid}/Messages/{sid}.json",
+            "subresource_uris": {"media": f"/2010-04-01/Accounts/{account_sid}/Messages/{sid}/Media.json"},
+        }
+        with self.lock:
+            self.messages.append(message)
+            self.stats["accepted"] += 1
+        if self.verbose:
+            print(f"{message['to']}: {message['body'][:60]!r}{' +media' if form.get('MediaUrl') else ''}")
+        return message
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Twilio Messages API.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency varies by up to this much either way")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 5xx")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--max-rate", type=float, help="requests per second before every further one gets a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    fake = FakeTwilio(args.port, args.latency, args.jitter, args.error_rate, args.throttle_rate,
+                      args.max_rate, args.retry_after, args.seed, verbose=True)
+    print(f"Fake Twilio Messages API on {fake.base_url} (TWILIO_API_BASE_URL={fake.base_url})")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+        print(", ".join(f"{k}: {v}" for k, v in fake.stats.items()))
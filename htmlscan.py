@@ -0,0 +1,201 @@
+import re
+from html import unescape
+from typing import Optional, Tuple
+
+# a tag ends at the first ">" outside a quoted attribute value
+_TAG_STOP = re.compile(r"""[>"']""")
+_TAG_NAME = re.compile(r"/?([a-zA-Z][a-zA-Z0-9]*)")
+# elements whose content is never visible text, with the pattern that ends them
+_RAW_TEXT = {name: re.compile("</" + name, re.IGNORECASE) for name in ("script", "style")}
+# what the image hunt stops at: an <img>, or a comment / raw-text element to skip whole
+_IMG_HOP  = re.compile(r"<(?:!--|(img|script|style)\b)", re.IGNORECASE)
+# name, then an optional double-quoted, single-quoted or bare value
+_ATTR     = re.compile(r"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+# elements that separate words even without surrounding whitespace
+_BREAKS = {"br", "p", "div", "li", "ul", "ol", "tr", "td", "th", "table",
+           "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "section", "article", "hr"}
+
+
+def _attr(tag: str, name: str) -> Optional[str]:
+    """Value of attribute `name` in the tag source `tag` (e.g. '<img src=x>')."""
+    if name not in tag.lower():
+        return None
+    m = _TAG_NAME.match(tag, 1)
+    for attr in _ATTR.finditer(tag, m.end() if m else 1):
+        if attr.group(1).lower() == name:
+            value = next((v for v in attr.group(2, 3, 4) if v is not None), None)
+            return unescape(value) if value else None
+    return None
+
+
+def _tag_end(html: str, start: int) -> int:
+    """Index just past the ">" closing the tag opened at `start`, or -1 if it never closes."""
+    pos = start + 1
+    while True:
+        m = _TAG_STOP.search(html, pos)
+        if m is None:
+            return -1
+        if m.group() == ">":
+            return m.end()
+        close = html.find(m.group(), m.end())
+        if close < 0:
+            return -1
+        pos = close + 1
+
+
+class _TextSink:
+    """Collects visible text with whitespace collapsed, tracking its length as it goes."""
+
+    def __init__(self):
+        self.parts  = []
+        self.length = 0
+        self.gap    = False
+
+    def space(self):
+        self.gap = bool(self.parts)
+
+    def add(self, text: str):
+        words = text.split()
+        if not words:
+            if text:
+                self.space()
+            return
+        if text[0].isspace():
+            self.space()
+        chunk = " ".join(words)
+        if self.gap:
+            chunk = " " + chunk
+        self.parts.append(chunk)
+        self.length += len(chunk)
+        self.gap = text[-1].isspace()
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+class HTMLScanner:
+    """Single forward pass over an HTML fragment that extracts its visible text
+    and, with `want_image`, the src of its first <img>.
+
+    Entities are decoded, whitespace is collapsed, and scanning stops as soon as
+    more than `max_len` characters of text have been produced (and an image found,
+    if wanted), so a huge summary costs no more than a short one when only a
+    preview is wanted. Every search moves strictly forward and no pattern
+    backtracks across the input, so the pass is linear even on hostile markup.
+    """
+    # raw text is decoded in windows of this size, so overshoot past max_len stays bounded
+    WINDOW = 256
+
+    def __init__(self, html: str, max_len: int, want_image: bool = False):
+        self.html       = html
+        self.max_len    = max_len
+        self.want_image = want_image
+        self.image: Optional[str] = None
+        self.sink       = _TextSink()
+
+    def _text(self, start: int, end: int):
+        html = self.html
+        while start < end and self.sink.length <= self.max_len:
+            stop = min(end, start + self.WINDOW)
+            if stop < end:
+                # don't split a character reference across windows
+                amp = html.rfind("&", stop - 10, stop)
+                if amp > start and html.find(";", amp, stop) < 0:
+                    stop = amp
+            self.sink.add(unescape(html[start:stop]))
+            start = stop
+
+    def scan(self) -> Tuple[str, Optional[str]]:
+        pos = self._scan_text()
+        if self.want_image and self.image is None:
+            self._scan_images(pos)
+        return self.sink.text(), self.image
+
+    def _scan_images(self, pos: int):
+        # text is complete: hop from <img to <img, skipping comments and script/style
+        # content the way _scan_text does, and looking at nothing else
+        html = self.html
+        while self.image is None:
+            m = _IMG_HOP.search(html, pos)
+            if m is None:
+                return
+            if m.group(1) is None:
+                close = html.find("-->", m.end())
+                if close < 0:
+                    return
+                pos = close + 3
+                continue
+            end = _tag_end(html, m.start())
+            if end < 0:
+                return
+            name = m.group(1).lower()
+            if name in _RAW_TEXT:
+                close = _RAW_TEXT[name].search(html, end)
+                if close is None:
+                    return
+                pos = close.start()
+                continue
+            self.image = _attr(html[m.start():end], "src")
+            pos = end
+
+    def _scan_text(self) -> int:
+        """Collect text up to the limit; returns where scanning stopped."""
+        html, n = self.html, len(self.html)
+        pos = 0
+        while pos < n and self.sink.length <= self.max_len:
+            lt = html.find("<", pos)
+            if lt < 0:
+                self._text(pos, n)
+                break
+            self._text(pos, lt)
+
+            if html.startswith("<!--", lt):
+                close = html.find("-->", lt + 4)
+                pos = n if close < 0 else close + 3
+                continue
+            m = _TAG_NAME.match(html, lt + 1)
+            if m is None:
+                # a bare "<" is just text
+                self._text(lt, lt + 1)
+                pos = lt + 1
+                continue
+            end = _tag_end(html, lt)
+            if end < 0:
+                # never closed: no tag follows, so the rest reads as text
+                self._text(lt, n)
+                return n
+            name = m.group(1).lower()
+            if name == "img" and self.want_image and self.image is None:
+                self.image = _attr(html[lt:end], "src")
+            if name in _BREAKS:
+                self.sink.space()
+            if name in _RAW_TEXT and not m.group().startswith("/"):
+                close = _RAW_TEXT[name].search(html, end)
+                pos = n if close is None else close.start()
+                continue
+            pos = end
+        return pos
+
+
+def _truncate(text: str, max_len: int) -> str:
+    text = text.strip()
+    if len(text) > max_len:
+        text = text[: max_len - 3].rsplit(" ", 1)[0] + "..."
+    return text
+
+
+def html_to_text(html: str, max_len: int) -> str:
+    """Visible text of `html`, truncated on a word boundary to at most `max_len` characters."""
+    return _truncate(HTMLScanner(html, max_len).scan()[0], max_len)
+
+
+def first_image(html: str) -> Optional[str]:
+    """src of the first <img> in `html`, with any quoting style."""
+    # a negative text limit skips text collection and goes straight to the <img> hunt
+    return HTMLScanner(html, -1, want_image=True).scan()[1]
+
+
+def summarize(html: str, max_len: int) -> Tuple[str, Optional[str]]:
+    """html_to_text() and first_image() from one pass over `html`."""
+    text, image = HTMLScanner(html, max_len, want_image=True).scan()
+    return _truncate(text, max_len), image
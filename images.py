@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from atomicfile import atomic_write
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+
+class PendingImage:
+    """Candidate image URLs in order of preference, each with its check in flight."""
+
+    def __init__(self, checks: List[Tuple[str, "Future"]]):
+        self.checks = checks
+
+    def result(self, timeout: Optional[float] = None) -> Optional[str]:
+        """The most preferred candidate that checked out, or None if none did."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for url, check in self.checks:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                if check.result(remaining):
+                    return url
+            except Exception:
+                continue
+        return None
+
+
+class ImageValidator:
+    """Checks that image URLs are reachable, really images and small enough to
+    attach, on a background thread pool so the checks overlap with parsing and
+    sending. Results are cached per URL for `ttl` seconds in `cache_file`.
+    """
+    # Twilio rejects media over 5 MB
+    MAX_BYTES = 5 * 1024 * 1024
+    # bytes requested when a server refuses HEAD
+    PROBE_BYTES = 2048
+
+    def __init__(self, cache_file: str = "image_cache.json", ttl: float = 6 * 3600,
+                 workers: int = 8, timeout: float = 10, user_agent: Optional[str] = None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.cache_file = cache_file
+        self.ttl        = ttl
+        self.timeout    = timeout
+        self.user_agent = user_agent
+        self.pool       = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-check")
+        self.lock       = threading.Lock()
+        # url -> [ok, checked_at]
+        self.cache: Dict[str, list] = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, "r") as f:
+                cutoff = time.time() - ttl
+                self.cache = {url: v for url, v in json.load(f).items() if v[1] >= cutoff}
+        self.inflight: Dict[str, "Future"] = {}
+
+    def submit(self, candidates: List[str]) -> PendingImage:
+        checks = []
+        for url in dict.fromkeys(u for u in candidates if u):
+            with self.lock:
+                cached = self.cache.get(url)
+                if cached and cached[1] >= time.time() - self.ttl:
+                    from concurrent.futures import Future
+                    check = Future()
+                    check.set_result(cached[0])
+                elif url in self.inflight:
+                    # the same image is often shared by several entries
+                    check = self.inflight[url]
+                else:
+                    check = self.inflight[url] = self.pool.submit(self._check, url)
+            checks.append((url, check))
+        return PendingImage(checks)
+
+    def _request(self, url: str, method: str, headers: dict):
+        if self.user_agent:
+            headers["User-Agent"] = self.user_agent
+        import urllib.request
+        req = urllib.request.Request(url, method=method, headers=headers)
+        return urllib.request.urlopen(req, timeout=self.timeout)
+
+    def _check(self, url: str) -> bool:
+        import urllib.error
+        ok = False
+        try:
+            try:
+                resp = self._request(url, "HEAD", {})
+            except urllib.error.HTTPError as e:
+                if e.code not in (403, 405, 501):
+                    raise
+                # some CDNs refuse HEAD; read just the first bytes instead
+                resp = self._request(url, "GET", {"Range": f"bytes=0-{self.PROBE_BYTES - 1}"})
+            with resp:
+                ctype = resp.headers.get("Content-Type", "")
+                total = resp.headers.get("Content-Range", "").rpartition("/")[2] or resp.headers.get("Content-Length")
+            ok = ctype.startswith("image/") and (not total or not total.isdigit() or int(total) <= self.MAX_BYTES)
+        except Exception:
+            # unreachable or malformed (http.client's InvalidURL, BadStatusLine...): not usable
+            ok = False
+        finally:
+            # whatever happened, later entries must not wait on this check
+            with self.lock:
+                self.cache[url] = [ok, time.time()]
+                self.inflight.pop(url, None)
+        return ok
+
+    def flush(self):
+        with self.lock:
+            # drop expired results, or a long-running daemon keeps every image it ever checked
+            cutoff     = time.time() - self.ttl
+            self.cache = {url: v for url, v in self.cache.items() if v[1] >= cutoff}
+            data       = dict(self.cache)
+        with atomic_write(self.cache_file) as f:
+            json.dump(data, f)
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.flush()
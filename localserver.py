@@ -0,0 +1,41 @@
+"""Local HTTP servers for benchmarks and offline runs (fake_twilio.py, snapshots.py, bench.py)."""
+import http.server
+import threading
+from typing import Optional
+
+
+class LocalServer:
+    """Serves `handler` on 127.0.0.1, on `port` or any free one.
+
+    The server runs in a background thread between start() and stop(), or for
+    the span of a `with` block. Keyword arguments become attributes of the
+    http.server instance, where the handler reaches them as self.server.<name>.
+    """
+
+    def __init__(self, handler, port: int = 0, **attrs):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        for name, value in attrs.items():
+            setattr(self.server, name, value)
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self) -> str:
+        """Serve in a background thread; returns the base URL."""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
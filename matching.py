@@ -0,0 +1,120 @@
+import re
+import json
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+def _trie_pattern(root: dict) -> str:
+    # "" marks the end of a keyword; the remaining keys are the next characters.
+    # Built bottom-up with an explicit stack: recursing once per character would
+    # overflow on a keyword a few thousand characters long
+    done: Dict[int, str] = {}
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for ch, child in node.items() if ch)
+            continue
+        branches = [(r"\s+" if ch == " " else re.escape(ch)) + done.pop(id(child))
+                    for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            pattern = ""
+        elif len(branches) == 1 and "" not in node:
+            pattern = branches[0]
+        else:
+            group   = "(?:" + "|".join(branches) + ")"
+            pattern = group + "?" if "" in node else group
+        done[id(node)] = pattern
+    return done[id(root)]
+
+
+class KeywordMatcher:
+    """Case-insensitive matcher for a set of keywords or phrases, compiled once
+    into a single regex.
+
+    The keywords are folded into a trie before compiling, so the alternation
+    shares prefixes and each title position follows one branch per character
+    rather than trying every keyword in turn. A keyword must start at a word
+    boundary; trailing letters are allowed so "episode" still matches "episodes".
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        # phrases match across any run of whitespace
+        self.keywords = sorted({" ".join(kw.lower().split()) for kw in keywords if kw.strip()})
+        trie: dict = {}
+        for kw in self.keywords:
+            node = trie
+            for ch in kw:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+        self.pattern = re.compile(r"(?<!\w)" + _trie_pattern(trie), re.IGNORECASE) if trie else None
+
+    @classmethod
+    def from_file(cls, path: str) -> "KeywordMatcher":
+        """One keyword or phrase per line; blank lines and lines starting with # are ignored."""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(line for line in f if not line.lstrip().startswith("#"))
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha1("\n".join(self.keywords).encode("utf-8")).hexdigest()
+
+    def search(self, text: str) -> Optional[str]:
+        """The first keyword occurrence in `text`, or None."""
+        if self.pattern is None:
+            return None
+        m = self.pattern.search(text)
+        return m.group(0) if m else None
+
+
+@dataclass
+class Subscription:
+    to: str
+    # phrases matched against whole title words; empty means "whatever the default filter lets through"
+    keywords: List[str] = field(default_factory=list)
+
+
+class SubscriptionRouter:
+    """Works out which subscribers a news title goes to.
+
+    Every rule phrase is indexed under its first word, so routing a title looks
+    up each of the title's own words once and only verifies the phrases that
+    start there; the cost does not depend on how many subscribers or rules exist.
+    """
+    TOKEN = re.compile(r"\w+")
+
+    def __init__(self, subscriptions: Iterable[Subscription]):
+        self.subscriptions = list(subscriptions)
+        # first word -> remaining words of a phrase -> subscribers that asked for it
+        self.index: Dict[str, Dict[Tuple[str, ...], Set[str]]] = {}
+        self.catch_all: Set[str] = set()
+        for sub in self.subscriptions:
+            if not sub.keywords:
+                self.catch_all.add(sub.to)
+            for phrase in sub.keywords:
+                words = self.TOKEN.findall(phrase.lower())
+                if words:
+                    self.index.setdefault(words[0], {}).setdefault(tuple(words[1:]), set()).add(sub.to)
+
+    @classmethod
+    def from_file(cls, path: str) -> "SubscriptionRouter":
+        """A JSON list of {"to": "whatsapp:+...", "keywords": [...]} objects."""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(Subscription(entry["to"], entry.get("keywords", [])) for entry in json.load(f))
+
+    @property
+    def fingerprint(self) -> str:
+        rules = sorted((sub.to, sorted(sub.keywords)) for sub in self.subscriptions)
+        return hashlib.sha1(json.dumps(rules).encode("utf-8")).hexdigest()
+
+    def route(self, title: str, default_match: bool = False) -> List[str]:
+        """Recipients for `title`; catch-all subscribers are included when `default_match`."""
+        recipients = set(self.catch_all) if default_match else set()
+        words = self.TOKEN.findall(title.lower())
+        for i, word in enumerate(words):
+            for rest, subscribers in self.index.get(word, {}).items():
+                if tuple(words[i + 1:i + 1 + len(rest)]) == rest:
+                    recipients |= subscribers
+        return sorted(recipients)
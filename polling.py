@@ -0,0 +1,108 @@
+import os
+import json
+import heapq
+from typing import Dict, List, Tuple
+
+from atomicfile import atomic_write
+
+
+class PublishCadence:
+    """How often one feed publishes, by UTC hour of day.
+
+    Every new entry adds weight to the hour it was published in, and all weights
+    decay with a half-life of `half_life` days, so the profile follows a feed
+    whose schedule drifts. With a daily decay factor d, an hour that steadily
+    gets x entries a day settles at a weight of x / (1 - d), which turns the
+    weights back into an expected publish rate.
+    """
+
+    def __init__(self, hist: List[float] = None, updated: float = 0.0, half_life: float = 14.0):
+        self.hist    = list(hist) if hist else [0.0] * 24
+        self.updated = updated
+        self.decay   = 0.5 ** (1 / half_life)
+
+    def _age(self, now: float):
+        if self.updated:
+            factor    = self.decay ** (max(0.0, now - self.updated) / 86400)
+            self.hist = [w * factor for w in self.hist]
+        self.updated = now
+
+    def observe(self, published: List[float], now: float):
+        self._age(now)
+        for at in published:
+            # entries published long ago (e.g. a feed's backlog on the first poll) weigh less
+            self.hist[int(at // 3600) % 24] += self.decay ** (max(0.0, now - at) / 86400)
+
+    def rate(self, at: float) -> float:
+        """Expected entries per hour around `at`: the busier of this hour and the next."""
+        hour = int(at // 3600) % 24
+        return max(self.hist[hour], self.hist[(hour + 1) % 24]) * (1 - self.decay)
+
+    def to_json(self) -> dict:
+        return {"hist": [round(w, 4) for w in self.hist], "updated": self.updated}
+
+
+class PollScheduler:
+    """Decides when each feed is polled next, from its learned PublishCadence.
+
+    A feed is polled about as often as it is expected to publish `target`
+    entries, within [min_interval, max_interval], so busy hours are polled
+    closely and quiet nights rarely. A poll that finds something published
+    within the last `burst_window` seconds drops that feed to `min_interval`
+    (an announcement burst rarely comes alone); each empty poll after that
+    doubles the interval until it is back at the learned one.
+    """
+
+    def __init__(self, feed_urls: List[str], path: str = "poll_stats.json",
+                 min_interval: float = 300, max_interval: float = 3 * 3600,
+                 target: float = 0.5, burst_window: float = 3600):
+        self.path         = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target       = target
+        self.burst_window = burst_window
+        stats = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                stats = json.load(f)
+        self.cadence: Dict[str, PublishCadence] = {
+            url: PublishCadence(**stats.get(url, {})) for url in feed_urls
+        }
+        self.interval: Dict[str, float] = {}
+        # (due time, url); every feed is due straight away on start-up
+        self.due: List[Tuple[float, str]] = [(0.0, url) for url in feed_urls]
+        heapq.heapify(self.due)
+
+    def learned_interval(self, url: str, now: float) -> float:
+        rate = self.cadence[url].rate(now)
+        interval = self.target / rate * 3600 if rate > 0 else self.max_interval
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def next_due(self) -> float:
+        return self.due[0][0] if self.due else float("inf")
+
+    def pop_due(self, now: float) -> List[str]:
+        """The feeds whose poll is due at `now`."""
+        urls = []
+        while self.due and self.due[0][0] <= now:
+            urls.append(heapq.heappop(self.due)[1])
+        return urls
+
+    def polled(self, url: str, published: List[float], now: float):
+        """Record what a poll of `url` found (publish times of its new entries) and reschedule it."""
+        self.cadence[url].observe(published, now)
+        learned = self.learned_interval(url, now)
+        if any(now - at < self.burst_window for at in published):
+            interval = self.min_interval
+        else:
+            interval = min(learned, self.interval.get(url, learned) * 2)
+        self.interval[url] = interval
+        heapq.heappush(self.due, (now + interval, url))
+
+    def failed(self, url: str, now: float):
+        """Reschedule `url` after a poll that failed: it taught nothing, so try again soon."""
+        heapq.heappush(self.due, (now + self.min_interval, url))
+
+    def flush(self):
+        with atomic_write(self.path) as f:
+            json.dump({url: c.to_json() for url, c in self.cadence.items()}, f)
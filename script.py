@@ -1,13 +1,22 @@
 import os
+import sys
 import time
+import signal
 import json
+import zlib
+import threading
 from datetime import datetime, timezone
-from dataclasses import dataclass
-from typing import Optional, Set
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
-import feedparser
-from twilio.rest import Client
-from dotenv import load_dotenv
+from atomicfile import atomic_write
+from htmlscan import first_image, html_to_text, summarize
+from images import ImageValidator, PendingImage
+from matching import KeywordMatcher, Subscription, SubscriptionRouter
+from polling import PollScheduler
+from sender import AsyncSender, SendScheduler
+from state import RejectedCache, SendWindow, StateStore, open_state
 
 
 @dataclass
@@ -17,106 +26,504 @@ class NewsItem:
     published: str
     summary: Optional[str] = None
     image: Optional[str] = None
+    recipients: List[str] = field(default_factory=list)
+    # the feed entry's ID, remembered as seen once the item is queued
+    uid: Optional[str] = None
+    # image candidates still being validated; resolved into `image` before sending
+    pending_image: Optional[PendingImage] = field(default=None, repr=False, compare=False)
+
+
+@dataclass
+class Delivery:
+    """One rendered message to one recipient, as stored in a message queue."""
+    to: str
+    title: str
+    link: str
+    body: str
+    media_url: Optional[str] = None
+    # the news item's fields, kept so queued items can still be packed into a digest
+    item: Optional[dict] = None
+    queued_at: float = 0.0
+    # the queue ("outbox" or "dead_letter") and keys of the entries this message covers
+    queue: Optional[str] = None
+    keys: List[str] = field(default_factory=list)
+
+    def payload(self) -> dict:
+        return {"to": self.to, "title": self.title, "link": self.link, "body": self.body,
+                "media_url": self.media_url, "item": self.item, "queued_at": self.queued_at}
+
+    @classmethod
+    def from_payload(cls, queue: str, key: str, payload: dict) -> "Delivery":
+        return cls(payload["to"], payload["title"], payload["link"], payload["body"],
+                   media_url=payload.get("media_url"), item=payload.get("item"),
+                   queued_at=payload.get("queued_at", 0.0), queue=queue, keys=[key])
+
+
+# feedparser, twilio and python-dotenv are imported on first use: a run that finds
+# nothing new never needs twilio, and together they cost more than the rest of startup.
+# The same goes for asyncio, urllib.request and xml.etree, imported where they are used
+
+@lru_cache(maxsize=None)
+def load_env():
+    """Load the nearest .env into the environment, searching up from this file's
+    directory as python-dotenv's own load_dotenv() does."""
+    from dotenv import find_dotenv, load_dotenv
+    path = find_dotenv()
+    if path:
+        load_dotenv(path)
+
+
+@lru_cache(maxsize=None)
+def header_recording_http_client():
+    """The HeaderRecordingHttpClient class; twilio is imported when it is first needed."""
+    from twilio.http.http_client import TwilioHttpClient
+
+    class HeaderRecordingHttpClient(TwilioHttpClient):
+        """Remembers each thread's last response headers, which the Twilio client does
+        not expose on errors, so a throttled send can honor Retry-After."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.local = threading.local()
+
+        def request(self, *args, **kwargs):
+            response = super().request(*args, **kwargs)
+            self.local.headers = response.headers or {}
+            return response
+
+        def last_headers(self) -> dict:
+            return getattr(self.local, "headers", {})
+
+    return HeaderRecordingHttpClient
+
+
+class FeedEntry(dict):
+    """Minimal stand-in for feedparser's entry dict: keys are also readable as attributes."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class TruncatedFeed(Exception):
+    """The response ended before the feed did (connection dropped mid-body)."""
+
+
+class FeedStream:
+    """Incrementally parses an RSS 2.0 / Atom response, yielding one FeedEntry per item.
+
+    The body is read in chunks and fed to an XMLPullParser, so the caller can stop
+    iterating (and close the response) as soon as it has what it needs. Everything
+    read so far is kept in `raw`, so a malformed feed can still be handed to feedparser.
+    A body that ends short of its Content-Length, its gzip trailer or its closing
+    tags raises TruncatedFeed instead.
+    """
+    CHUNK_SIZE = 16 * 1024
+    MEDIA_NS   = "http://search.yahoo.com/mrss/"
+
+    def __init__(self, resp):
+        self.resp     = resp
+        self.raw      = []
+        gzipped       = resp.headers.get("Content-Encoding") == "gzip"
+        self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        length        = resp.headers.get("Content-Length", "")
+        self.expected = int(length) if length.isdigit() else None
+        self.received = 0
+
+    def _chunks(self) -> Iterator[bytes]:
+        while True:
+            chunk = self.resp.read(self.CHUNK_SIZE)
+            if not chunk:
+                # http.client just returns b"" when the server hangs up early
+                if self.expected is not None and self.received < self.expected:
+                    raise TruncatedFeed(f"response ended after {self.received} of {self.expected} bytes")
+                if self._inflate:
+                    if not self._inflate.eof:
+                        raise TruncatedFeed("gzip stream ended early")
+                    tail = self._inflate.flush()
+                    if tail:
+                        self.raw.append(tail)
+                        yield tail
+                return
+            self.received += len(chunk)
+            if self._inflate:
+                chunk = self._inflate.decompress(chunk)
+            self.raw.append(chunk)
+            yield chunk
+
+    def read_all(self) -> bytes:
+        """Drain the rest of the response and return the whole (decoded) body."""
+        for _ in self._chunks():
+            pass
+        return b"".join(self.raw)
+
+    def __iter__(self) -> Iterator[FeedEntry]:
+        import xml.etree.ElementTree as ET
+        parser = ET.XMLPullParser(events=("end",))
+        for chunk in self._chunks():
+            parser.feed(chunk)
+            for _, elem in parser.read_events():
+                if elem.tag.rsplit("}", 1)[-1] in ("item", "entry"):
+                    yield self._to_entry(elem)
+                    elem.clear()
+        try:
+            parser.close()
+        except ET.ParseError as e:
+            # the whole body arrived but the document is unfinished: cut off at the source
+            raise TruncatedFeed(f"feed ended mid-document ({e})") from e
+
+    def _to_entry(self, elem) -> FeedEntry:
+        entry = FeedEntry()
+        for child in elem:
+            ns, _, tag = child.tag[1:].rpartition("}") if child.tag.startswith("{") else ("", "", child.tag)
+            text = (child.text or "").strip()
+            if ns == self.MEDIA_NS:
+                if tag == "content":
+                    entry.setdefault("media_content", []).append(dict(child.attrib))
+                elif tag == "thumbnail":
+                    entry.setdefault("media_thumbnail", []).append(dict(child.attrib))
+            elif tag == "title":
+                entry["title"] = text
+            elif tag == "link":
+                # Atom carries the URL in href; prefer the alternate link
+                href = child.get("href")
+                if href is None:
+                    entry["link"] = text
+                elif child.get("rel", "alternate") == "alternate":
+                    entry.setdefault("link", href)
+            elif tag in ("guid", "id"):
+                entry["id"] = text
+            elif tag in ("description", "summary"):
+                entry["summary"] = text
+            elif tag == "content" and "summary" not in entry:
+                entry["summary"] = text
+            elif tag in ("pubDate", "published", "updated"):
+                entry.setdefault("published", text)
+            elif tag == "enclosure":
+                enc = dict(child.attrib)
+                enc["href"] = enc.pop("url", enc.get("href"))
+                entry.setdefault("enclosures", []).append(enc)
+        return entry
 
 
 class WhatsAppRSSBot:
+    # at most DAILY_LIMIT sends in any rolling QUOTA_WINDOW seconds
     DAILY_LIMIT = 9
-    COUNT_FILE = "daily_count.json"
+    QUOTA_WINDOW = 24 * 3600
+    # HTTP validators (ETag / Last-Modified) from the last successful fetch
+    CACHE_FILE = "feed_cache.json"
     # only send items whose title contains one of these keywords
     FILTER_KEYWORDS = ["anime", "premiere", "episode", "season", "release"]
+    # one keyword per line; replaces FILTER_KEYWORDS when present (override with FILTER_KEYWORDS_FILE)
+    KEYWORDS_FILE = "keywords.txt"
+    # per-subscriber rules; without it everything goes to TWILIO_WHATSAPP_TO (override with SUBSCRIBERS_FILE)
+    SUBSCRIBERS_FILE = "subscribers.json"
+    # at most this many feed downloads are in flight at once
+    MAX_CONNECTIONS = 4
+    FETCH_TIMEOUT = 30
+    USER_AGENT = "NakamaNewsBot/1.0 (+https://github.com/Prodigy-Genes/Anime_Updates)"
+    # feeds are newest-first: stop reading after this many consecutive known entries
+    SEEN_RUN_LIMIT = 3
+    # seen IDs not observed in any feed for this long are forgotten (0 keeps them forever)
+    SEEN_TTL_DAYS = 60
+    # entries the keyword filter rejected are not looked at again for this long
+    REJECTED_TTL_DAYS = 7
+    # how long a send waits for its image checks before going out without media
+    IMAGE_CHECK_TIMEOUT = 15
+    # send pacing: messages per second, burst size and requests in flight
+    SEND_RATE = 1.0
+    SEND_BURST = 1
+    SEND_CONCURRENCY = 4
+    # tries per message before a transient failure goes to the dead-letter queue
+    SEND_MAX_ATTEMPTS = 4
+    # SEND_SPREAD=1: how far ahead (seconds) one run sends spread-out messages before
+    # leaving the rest to later runs; set it to the cron interval
+    SEND_HORIZON = 0
+    # Twilio's cap on a WhatsApp message body
+    MAX_BODY = 1600
+    # digest mode: items queued for the same recipient within one window share messages
+    DIGEST_WINDOW = 6 * 3600
+    # daemon mode: bounds on the learned per-feed polling interval, in seconds
+    POLL_MIN_INTERVAL = 300
+    POLL_MAX_INTERVAL = 3 * 3600
+    # processes sharing a SQLite state take turns to run; a crashed run's turn lapses
+    # after this long (plus SEND_HORIZON, which a spread-out run may spend sending)
+    RUN_LEASE = 3600
 
-    def __init__(self, feed_url: str):
-        load_dotenv()
-        self.feed_url      = feed_url
-        self.seen_file     = "seen_ids.txt"
-        self.seen: Set[str]= self._load_seen()
+    def __init__(self, feed_url: Union[str, List[str]]):
+        load_env()
+        self.feed_urls     = [feed_url] if isinstance(feed_url, str) else list(feed_url)
+        self.feed_url      = self.feed_urls[0]
+        self.seen_ttl      = float(os.getenv("SEEN_TTL_DAYS", self.SEEN_TTL_DAYS)) * 86400 or None
+        # STATE_BACKEND: "file" (seen_ids.txt, send_times.json), "hashed" (seen_ids.idx) or "sqlite" (STATE_DB)
+        # SEEN_FILTER=bloom puts a persisted Bloom filter in front of the seen-ID lookups
+        self.state: StateStore = open_state(
+            os.getenv("STATE_BACKEND", "file"),
+            os.getenv("STATE_DB", "state.db"),
+            seen_filter    = os.getenv("SEEN_FILTER", ""),
+            bloom_capacity = int(os.getenv("BLOOM_CAPACITY", "1000000")),
+            bloom_fp_rate  = float(os.getenv("BLOOM_FP_RATE", "0.001")),
+            ttl            = self.seen_ttl
+        )
 
-        # Daily send count
-        self.today_str, self.sent_count = self._load_daily_count()
+        # Title filter, compiled once
+        keywords_file      = os.getenv("FILTER_KEYWORDS_FILE", self.KEYWORDS_FILE)
+        if os.path.exists(keywords_file):
+            self.matcher   = KeywordMatcher.from_file(keywords_file)
+        else:
+            self.matcher   = KeywordMatcher(self.FILTER_KEYWORDS)
 
-        # Twilio / WhatsApp creds
-        self.client        = Client(
-            os.getenv("TWILIO_ACCOUNT_SID"),
-            os.getenv("TWILIO_AUTH_TOKEN")
-        )
+        # Twilio / WhatsApp creds; the client itself is built on the first send
+        self._client       = None
+        self.http_client   = None
+        self.client_lock   = threading.Lock()
         self.from_whatsapp = os.getenv("TWILIO_WHATSAPP_FROM")
         self.to_whatsapp   = os.getenv("TWILIO_WHATSAPP_TO")
+        self.sender        = AsyncSender(
+            self._deliver,
+            rate         = float(os.getenv("SEND_RATE", self.SEND_RATE)),
+            burst        = int(os.getenv("SEND_BURST", self.SEND_BURST)),
+            concurrency  = int(os.getenv("SEND_CONCURRENCY", self.SEND_CONCURRENCY)),
+            classify     = self._classify,
+            max_attempts = int(os.getenv("SEND_MAX_ATTEMPTS", self.SEND_MAX_ATTEMPTS))
+        )
+        # SEND_SPREAD=1 spaces sends evenly, one QUOTA_WINDOW / DAILY_LIMIT apart
+        self.scheduler     = SendScheduler(float(os.getenv("SEND_HORIZON", self.SEND_HORIZON))) \
+            if os.getenv("SEND_SPREAD") == "1" else None
+
+        # Who gets which item
+        subscribers_file   = os.getenv("SUBSCRIBERS_FILE", self.SUBSCRIBERS_FILE)
+        if os.path.exists(subscribers_file):
+            self.router    = SubscriptionRouter.from_file(subscribers_file)
+        else:
+            self.router    = SubscriptionRouter([Subscription(self.to_whatsapp)])
+
+        # changing the keywords or subscriptions invalidates earlier rejections
+        self.rejected      = RejectedCache(
+            ttl         = self.REJECTED_TTL_DAYS * 86400,
+            fingerprint = self.matcher.fingerprint + self.router.fingerprint
+        )
+
+        # VALIDATE_IMAGES=1 checks candidate images in the background before they are attached
+        self.image_validator = ImageValidator(user_agent=self.USER_AGENT) if os.getenv("VALIDATE_IMAGES") == "1" else None
+
+        # Conditional GET validators per feed URL; not_modified is set when every feed answers 304
+        self.validators    = self._load_validators()
+        self.not_modified  = False
+        # publish times of the entries each feed yielded that were new to the bot, for the poll scheduler
+        self.published: Dict[str, List[float]] = {}
+        # feeds whose last fetch failed (HTTP error, timeout, truncated body...)
+        self.failed_feeds: List[str] = []
+
+        # Recent send times, for the rolling quota
+        self.send_window   = SendWindow(
+            self.DAILY_LIMIT,
+            self.QUOTA_WINDOW,
+            self.state.load_send_times(time.time() - self.QUOTA_WINDOW)
+        )
+
+        # rendered messages waiting for quota, and ones that kept failing transiently;
+        # the dead letters go first
+        self.queues        = {name: self.state.queue(name) for name in ("dead_letter", "outbox")}
+        # DIGEST_MODE=1 packs queued items into as few messages as fit
+        self.digest_mode   = os.getenv("DIGEST_MODE") == "1"
+        self.digest_window = float(os.getenv("DIGEST_WINDOW", self.DIGEST_WINDOW))
+
+    def _load_validators(self) -> Dict[str, dict]:
+        if not os.path.exists(self.CACHE_FILE):
+            return {}
+        with open(self.CACHE_FILE, "r") as f:
+            return json.load(f)
+
+    def _save_validators(self):
+        # an interrupted write must not leave a truncated file that fails every later start
+        with atomic_write(self.CACHE_FILE) as f:
+            json.dump(self.validators, f)
+
+    def _download(self, url: str) -> Optional[list]:
+        """Fetch the new head of one feed, or None when the server answers 304 Not Modified."""
+        headers = {"User-Agent": self.USER_AGENT, "Accept-Encoding": "gzip"}
+        cached  = self.validators.get(url, {})
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("modified"):
+            headers["If-Modified-Since"] = cached["modified"]
 
-    def _load_seen(self) -> Set[str]:
-        if not os.path.exists(self.seen_file):
-            return set()
-        with open(self.seen_file, "r") as f:
-            return set(line.strip() for line in f)
-
-    def _save_seen(self):
-        with open(self.seen_file, "w") as f:
-            for eid in sorted(self.seen):
-                f.write(eid + "\n")
-
-    def _load_daily_count(self):
-        today = datetime.now(timezone.utc).date().isoformat()
-        if os.path.exists(self.COUNT_FILE):
-            with open(self.COUNT_FILE, "r") as f:
-                data = json.load(f)
-            if data.get("date") == today:
-                return today, data.get("count", 0)
-        return today, 0
-
-    def _save_daily_count(self):
-        data = {"date": self.today_str, "count": self.sent_count}
-        with open(self.COUNT_FILE, "w") as f:
-            json.dump(data, f)
-
-    def fetch_feed(self):
-        feed = feedparser.parse(self.feed_url)
+        import urllib.request
+        import urllib.error
+        req = urllib.request.Request(url, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=self.FETCH_TIMEOUT) as resp:
+                entries = self._read_new_entries(FeedStream(resp))
+                # only remember validators the server actually sent back, and only once the
+                # body was read through (or left on purpose): after a failed read the next
+                # run must refetch instead of getting a 304
+                self.validators[url] = {
+                    k: v for k, v in (("etag", resp.headers.get("ETag")),
+                                      ("modified", resp.headers.get("Last-Modified"))) if v
+                }
+                return entries
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+
+    def _read_new_entries(self, stream: FeedStream) -> list:
+        import xml.etree.ElementTree as ET
+        entries = []
+        known   = 0
+        try:
+            for entry in stream:
+                entries.append(entry)
+                uid = self._entry_uid(entry)
+                if uid in self.state or uid in self.rejected:
+                    known += 1
+                    # the rest of the feed is older; leaving now also stops the download
+                    if known >= self.SEEN_RUN_LIMIT:
+                        break
+                else:
+                    known = 0
+        except ET.ParseError:
+            # not well-formed XML (e.g. bare HTML entities); let feedparser cope with it
+            import feedparser
+            return feedparser.parse(stream.read_all()).entries
+        return entries
+
+    @staticmethod
+    def _entry_uid(entry) -> str:
+        return getattr(entry, "id", None) or entry.link
+
+    async def _download_all(self, urls: List[str]) -> List[Optional[list]]:
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=self.MAX_CONNECTIONS) as pool:
+            tasks = [loop.run_in_executor(pool, self._download, url) for url in urls]
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def fetch_feed(self, urls: Optional[List[str]] = None):
+        import asyncio
+        urls    = self.feed_urls if urls is None else urls
+        results = asyncio.run(self._download_all(urls))
+
+        self.not_modified = all(entries is None for entries in results)
+        self.published    = {url: [] for url in urls}
+        self.failed_feeds = [url for url, entries in zip(urls, results) if isinstance(entries, Exception)]
+        new_items = []
+        # entries taken from one feed this run, so another feed's copy is skipped
+        taken     = set()
+        for url, entries in zip(urls, results):
+            if isinstance(entries, Exception):
+                print(f"Failed to fetch {url}:", entries)
+                continue
+            if entries is None:
+                continue
+            new_items.extend(self._process_entries(entries, self.published[url], taken))
+
+        return new_items
+
+    def _process_entries(self, entries, published: Optional[List[float]] = None,
+                         taken: Optional[set] = None) -> List[NewsItem]:
+        """News items for the entries worth sending; the publish time of every entry
+        new to the bot, sent or not, is appended to `published`. The items' IDs are
+        added to `taken`, not to state: they only count as seen once queued."""
         new_items = []
-        for entry in feed.entries:
-            uid = getattr(entry, "id", entry.link)
-            if uid in self.seen:
+        taken     = set() if taken is None else taken
+        for entry in entries:
+            uid = self._entry_uid(entry)
+            if uid in self.state:
+                self.state.touch(uid)
                 continue
+            if uid in taken:
+                continue
+            if uid in self.rejected:
+                continue
+            # anything older than the seen-ID horizon may have expired from state; never resend it
+            published_at = self._published_at(entry)
+            if self.seen_ttl and published_at and published_at < time.time() - self.seen_ttl:
+                continue
+            if published is not None:
+                published.append(published_at or time.time())
 
-            title_lower = entry.title.lower()
-            # only include if title contains at least one FILTER_KEYWORDS
-            if not any(kw in title_lower for kw in self.FILTER_KEYWORDS):
+            # the default filter keywords feed catch-all subscribers; the rest have their own rules
+            recipients = self.router.route(entry.title, bool(self.matcher.search(entry.title)))
+            if not recipients:
+                self.rejected.add(uid)
                 continue
 
+            summary, images = self._summarize(entry)
             item = NewsItem(
                 title      = entry.title,
                 link       = entry.link,
                 published  = entry.get("published", datetime.now(timezone.utc).isoformat()),
-                summary    = self._clean_summary(entry.get("summary", "")),
-                image      = self._extract_image(entry)
+                summary    = summary,
+                image      = images[0] if images else None,
+                recipients = recipients,
+                uid        = uid
             )
+            if self.image_validator and images:
+                item.pending_image = self.image_validator.submit(images)
             new_items.append(item)
-            self.seen.add(uid)
+            taken.add(uid)
 
         return new_items
 
+    @staticmethod
+    def _published_at(entry) -> Optional[float]:
+        value = entry.get("published")
+        if not value:
+            return None
+        try:
+            # RSS uses RFC 822 dates, Atom uses ISO 8601
+            if value[:4].isdigit():
+                dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            else:
+                from email.utils import parsedate_to_datetime
+                dt = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+
     def _clean_summary(self, html: str, max_len: int = 200) -> str:
-        import re
-        text = re.sub(r"<[^>]+>", "", html).strip()
-        if len(text) > max_len:
-            text = text[: max_len - 3].rsplit(" ", 1)[0] + "..."
-        return text
+        return html_to_text(html, max_len)
 
-    def _extract_image(self, entry) -> Optional[str]:
+    def _summarize(self, entry, max_len: int = 200):
+        """Cleaned summary and image candidates (best first) for an entry, walking the
+        summary HTML only once."""
+        images = self._feed_images(entry)
+        if images and not self.image_validator:
+            # only the first candidate will be used; no need to look for one in the HTML
+            return self._clean_summary(entry.get("summary", ""), max_len), images[:1]
+        summary, inline = summarize(entry.get("summary", ""), max_len)
+        return summary, images + [inline] if inline else images
+
+    def _feed_images(self, entry) -> List[str]:
+        images = []
         if hasattr(entry, "enclosures") and entry.enclosures:
-            for enc in entry.enclosures:
-                if enc.get("type", "").startswith("image/"):
-                    return enc.get("href")
+            images += [enc.get("href") for enc in entry.enclosures if enc.get("type", "").startswith("image/")]
         if hasattr(entry, "media_content") and entry.media_content:
-            return entry.media_content[0].get("url")
+            images += [media.get("url") for media in entry.media_content
+                       if media.get("medium", "image") == "image" and media.get("type", "image/").startswith("image/")]
         if hasattr(entry, "media_thumbnail") and entry.media_thumbnail:
-            return entry.media_thumbnail[0].get("url")
-        import re
-        m = re.search(r'<img[^>]+src="([^">]+)"', entry.get("summary", ""))
-        if m:
-            return m.group(1)
-        return None
-
-    def send_whatsapp(self, item: NewsItem):
+            images += [thumb.get("url") for thumb in entry.media_thumbnail]
+        return [url for url in images if url]
+
+    def _extract_image(self, entry) -> Optional[str]:
+        images = self._feed_images(entry)
+        return images[0] if images else first_image(entry.get("summary", ""))
+
+    def _resolve_image(self, item: NewsItem):
+        if item.pending_image is not None:
+            item.image = item.pending_image.result(self.IMAGE_CHECK_TIMEOUT)
+            item.pending_image = None
+
+    def render(self, item: NewsItem) -> str:
         header = "📰 *Nakama News 中間ニュース Anime Release Update * 📢\n"
-        body   = (
+        return (
             f"{header}"
             f"*{item.title}*\n"
             f"_Published: {item.published}_\n\n"
@@ -124,36 +531,306 @@ class WhatsAppRSSBot:
             f"👉 Read more: {item.link}"
         )
 
+    def render_digest_entry(self, item: dict) -> str:
+        return f"• *{item['title']}*\n_{item['published']}_\n👉 {item['link']}\n\n"
+
+    def render_digest(self, entries: List[str]) -> str:
+        header = "📰 *Nakama News 中間ニュース Anime Release Digest * 📢\n\n"
+        return (header + "".join(entries)).rstrip()
+
+    def send_whatsapp(self, item: NewsItem, to: Optional[str] = None) -> str:
+        return self._send_message(to or self.to_whatsapp, self.render(item), item.image)
+
+    @property
+    def client(self):
+        """The Twilio client, created on first use; sender threads may race for it."""
+        with self.client_lock:
+            if self._client is None:
+                from twilio.rest import Client
+                self.http_client = header_recording_http_client()()
+                self._client     = Client(
+                    os.getenv("TWILIO_ACCOUNT_SID"),
+                    os.getenv("TWILIO_AUTH_TOKEN"),
+                    http_client = self.http_client
+                )
+                # TWILIO_API_BASE_URL points the client somewhere else, e.g. at fake_twilio.py
+                if os.getenv("TWILIO_API_BASE_URL"):
+                    self._client.api.base_url = os.getenv("TWILIO_API_BASE_URL").rstrip("/")
+            return self._client
+
+    def _send_message(self, to: str, body: str, media_url: Optional[str] = None) -> str:
         kwargs = {
             'from_': self.from_whatsapp,
-            'to':    self.to_whatsapp,
+            'to':    to or self.to_whatsapp,
             'body':  body
         }
-        if item.image:
-            kwargs['media_url'] = [item.image]
+        if media_url:
+            kwargs['media_url'] = [media_url]
 
-        msg = self.client.messages.create(**kwargs)
+        try:
+            msg = self.client.messages.create(**kwargs)
+        except Exception as e:
+            e.retry_after = self._retry_after(self.http_client and self.http_client.last_headers())
+            raise
         print(f"Sent SID: {msg.sid}")
+        return msg.sid
+
+    @staticmethod
+    def _retry_after(headers) -> Optional[float]:
+        value = (headers or {}).get("Retry-After")
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        from email.utils import parsedate_to_datetime
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _classify(error: Exception) -> Tuple[bool, Optional[float]]:
+        """(transient?, seconds the provider asked us to wait) for a failed send."""
+        status = getattr(error, "status", None)
+        if isinstance(status, int):
+            # throttling and server trouble pass; other 4xx (bad number, bad media...) will not
+            return status == 429 or status >= 500, getattr(error, "retry_after", None)
+        # no HTTP status: connection errors and timeouts are worth another try
+        return isinstance(error, OSError), None
+
+    def run(self, feed_urls: Optional[List[str]] = None):
+        """Poll `feed_urls` (default: every feed) and send what is due."""
+        horizon = self.scheduler.horizon if self.scheduler else 0.0
+        if not self.state.acquire_lease(self.RUN_LEASE + horizon):
+            print("Another bot process is polling and sending with this state; skipping this run.")
+            self.published    = {}
+            self.failed_feeds = list(self.feed_urls if feed_urls is None else feed_urls)
+            return
+        try:
+            self._run(feed_urls)
+        finally:
+            self.state.release_lease()
 
-    def run(self):
-        new_posts = self.fetch_feed()
+    def _run(self, feed_urls: Optional[List[str]]):
+        # another process sharing the state may have sent since this one last looked
+        now = time.time()
+        self.send_window = SendWindow(self.DAILY_LIMIT, self.QUOTA_WINDOW,
+                                      self.state.load_send_times(now - self.QUOTA_WINDOW))
+        new_posts = self.fetch_feed(feed_urls)
+        if new_posts:
+            self._enqueue(new_posts)
+        pending = self._pending()
+        if self.digest_mode:
+            pending = self._digest(pending)
+        if self.not_modified and not pending:
+            print("Feeds not modified since last run; nothing to do.")
+            return
+        retries = sum(1 for d in pending if d.queue == "dead_letter")
+        if retries:
+            print(f"Retrying {retries} message(s) from the dead-letter queue.")
         if not new_posts:
             print("No new anime-release items.")
-        for post in new_posts:
-            if self.sent_count >= self.DAILY_LIMIT:
-                print(f"Daily limit of {self.DAILY_LIMIT} reached; stopping further messages.")
-                break
-            try:
-                self.send_whatsapp(post)
-                self.sent_count += 1
-                self._save_daily_count()
-                time.sleep(1)
-            except Exception as e:
-                print("Failed to send:", e)
-        self._save_seen()
+        now    = time.time()
+        # a spent quota, the usual case between daemon wake-ups, needs no walk of the ring
+        budget = self.send_window.remaining(now) if self.send_window.allows(now) else 0
+        if self.scheduler:
+            interval = self.QUOTA_WINDOW / self.DAILY_LIMIT
+            # carry on from the previous run's last send rather than starting a new burst
+            start    = max(0.0, self.send_window.last + interval - now)
+            planned  = self.scheduler.plan(pending, budget, interval, start, self._priority)
+            if len(planned) < len(pending):
+                print(f"Spreading sends {interval / 60:.0f} min apart; "
+                      f"{len(pending) - len(planned)} message(s) stay queued for later runs.")
+            jobs, delays = [d for _, d in planned], [delay for delay, _ in planned]
+        else:
+            if len(pending) > budget:
+                print(f"Limit of {self.DAILY_LIMIT} sends per {self.QUOTA_WINDOW / 3600:.0f}h reached; "
+                      f"{len(pending) - budget} message(s) stay queued for a later run.")
+            jobs, delays = pending[:budget], None
+        if jobs:
+            # build the client up front: a missing twilio package or missing credentials
+            # must stop the run, not count as a permanent failure of every queued message
+            self.client
+        self.sender.run(jobs, self._on_sent, delays)
+        self.state.flush()
+        self.rejected.flush()
+        if self.image_validator:
+            self.image_validator.flush()
+        # persist validators last, so a crash mid-run refetches the full feed next time
+        self._save_validators()
+
+    def _next_send_in(self) -> float:
+        """Seconds until a queued message could go out, or inf with nothing queued."""
+        if not any(len(queue) for queue in self.queues.values()):
+            return float("inf")
+        now  = time.time()
+        wait = self.send_window.wait(now)
+        if self.scheduler:
+            interval = self.QUOTA_WINDOW / self.DAILY_LIMIT
+            wait     = max(wait, self.send_window.last + interval - now)
+        return max(0.0, wait)
+
+    def daemon(self):
+        """Poll forever, each feed on its own learned interval, keeping clients and state in memory."""
+        polls = PollScheduler(
+            self.feed_urls,
+            min_interval = float(os.getenv("POLL_MIN_INTERVAL", self.POLL_MIN_INTERVAL)),
+            max_interval = float(os.getenv("POLL_MAX_INTERVAL", self.POLL_MAX_INTERVAL))
+        )
+        # set when waking up for queued messages sent nothing (e.g. only failing dead letters);
+        # then only the next poll retries them
+        stalled = False
+        while True:
+            now = time.time()
+            due = polls.pop_due(now)
+            if due:
+                try:
+                    self.run(due)
+                except Exception as e:
+                    # one bad poll must not end the daemon; these feeds are retried shortly.
+                    # Entries only count as seen once queued, so nothing this poll picked is lost
+                    print(f"Poll of {', '.join(due)} failed:", e)
+                    now = time.time()
+                    for url in due:
+                        polls.failed(url, now)
+                else:
+                    now = time.time()
+                    for url in due:
+                        if url in self.failed_feeds:
+                            # a 404 or a timeout says nothing about the feed's cadence
+                            polls.failed(url, now)
+                        else:
+                            polls.polled(url, self.published.get(url, []), now)
+                    polls.flush()
+                stalled = False
+            elif not stalled and self._next_send_in() <= 0:
+                # a quota slot opened up for messages still queued
+                last = self.send_window.last
+                try:
+                    self.run([])
+                except Exception as e:
+                    print("Sending queued messages failed:", e)
+                stalled = self.send_window.last == last
+            wake = polls.next_due() if stalled else min(polls.next_due(), now + self._next_send_in())
+            time.sleep(max(1.0, wake - time.time()))
+
+    @staticmethod
+    def _priority(delivery: Delivery) -> Tuple[bool, float]:
+        # dead letters have waited longest, then oldest queued first
+        return delivery.queue != "dead_letter", delivery.queued_at
+
+    def _enqueue(self, posts: List[NewsItem]):
+        outbox = self.queues["outbox"]
+        now    = time.time()
+        for post in posts:
+            self._resolve_image(post)
+            body = self.render(post)
+            item = {"title": post.title, "link": post.link, "published": post.published,
+                    "summary": post.summary, "image": post.image}
+            for to in post.recipients:
+                outbox.push(Delivery(to, post.title, post.link, body, post.image, item, now).payload())
+            # only once the outbox holds it is it safe to remember this entry as seen: a run
+            # that fails before here (and the store's flush on close) must not lose it
+            self.state.add(post.uid)
+        self.state.flush()
+
+    def _pending(self) -> List[Delivery]:
+        return [Delivery.from_payload(name, key, payload)
+                for name, queue in self.queues.items() for key, payload in queue.items()]
+
+    def _digest(self, pending: List[Delivery]) -> List[Delivery]:
+        """Group outbox deliveries by recipient and queueing window, and pack each group
+        into as few messages as fit in MAX_BODY."""
+        digested = []
+        groups: Dict[Tuple[str, int], List[Delivery]] = {}
+        for d in pending:
+            if d.queue != "outbox" or not d.item:
+                digested.append(d)
+                continue
+            window = int(d.queued_at // self.digest_window) if self.digest_window else 0
+            groups.setdefault((d.to, window), []).append(d)
+
+        header_len = len(self.render_digest([]))
+        for group in groups.values():
+            batch, size = [], header_len
+            for d in group:
+                entry = self.render_digest_entry(d.item)
+                if batch and size + len(entry) > self.MAX_BODY:
+                    digested.append(self._digest_delivery(batch))
+                    batch, size = [], header_len
+                batch.append((d, entry))
+                size += len(entry)
+            if batch:
+                digested.append(self._digest_delivery(batch))
+        return digested
+
+    def _digest_delivery(self, batch: List[Tuple[Delivery, str]]) -> Delivery:
+        first = batch[0][0]
+        if len(batch) == 1:
+            # a lone item keeps its full message, summary included
+            return first
+        return Delivery(
+            first.to,
+            f"Digest of {len(batch)} items",
+            first.link,
+            self.render_digest([entry for _, entry in batch]),
+            media_url = next((d.media_url for d, _ in batch if d.media_url), None),
+            queue     = first.queue,
+            keys      = [key for d, _ in batch for key in d.keys]
+        )
+
+    def _deliver(self, delivery: Delivery) -> str:
+        # runs on a sender thread
+        return self._send_message(delivery.to, delivery.body, delivery.media_url)
+
+    def _on_sent(self, delivery: Delivery, sid: Optional[str], error: Optional[Exception]):
+        # runs on the sender's event loop thread, one call at a time
+        queue = self.queues[delivery.queue]
+        if error is None:
+            now = time.time()
+            self.send_window.record(now)
+            self.state.record_sent(now, now - self.QUOTA_WINDOW)
+            self.state.record_send(delivery.to, delivery.title, delivery.link, sid, "sent")
+            self._remove(queue, delivery)
+            return
+
+        print("Failed to send:", error)
+        transient, _ = self._classify(error)
+        if not transient:
+            self.state.record_send(delivery.to, delivery.title, delivery.link, None, "failed")
+            self._remove(queue, delivery)
+        elif delivery.queue == "outbox":
+            # park it; the next run retries it before anything new
+            self.queues["dead_letter"].push(delivery.payload())
+            self._remove(queue, delivery)
+            self.state.record_send(delivery.to, delivery.title, delivery.link, None, "dead_letter")
+
+    @staticmethod
+    def _remove(queue, delivery: Delivery):
+        for key in delivery.keys:
+            queue.remove(key)
+
+    def close(self):
+        if self.image_validator:
+            # drops checks still queued for items that were not sent
+            self.image_validator.close()
+        self.state.close()
 
 
 if __name__ == "__main__":
     RSS_URL = "https://cr-news-api-service.prd.crunchyrollsvc.com/v1/en-US/rss"
-    bot = WhatsAppRSSBot(RSS_URL)
-    bot.run()
+    load_env()
+    # RSS_FEEDS: optional comma-separated list of feed URLs to poll together
+    feeds = [u.strip() for u in os.getenv("RSS_FEEDS", RSS_URL).split(",") if u.strip()]
+    bot = WhatsAppRSSBot(feeds)
+    # stop a daemon cleanly on `kill` as well as Ctrl-C, so state still gets flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if "--daemon" in sys.argv[1:]:
+            bot.daemon()
+        else:
+            bot.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bot.close()
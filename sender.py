@@ -0,0 +1,154 @@
+import time
+import heapq
+import random
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average and up to `burst` at once."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate   = rate
+        self.burst  = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last   = time.monotonic()
+
+    def _refill(self):
+        now         = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last   = now
+
+    async def acquire(self):
+        import asyncio
+        # callers share one event loop, so nothing can run between the check and the take
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now, without waiting."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds: float):
+        """Hold every caller back for `seconds`, e.g. when the provider says to slow down.
+        Pauses overlap rather than add up: several sends throttled at once wait once."""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class SendScheduler:
+    """Spreads sends evenly over time instead of sending them back-to-back.
+
+    Sends are due one `interval` apart, highest priority first, starting
+    `start` seconds from now, so the provider sees a steady trickle instead of
+    a burst whenever the bot runs. Only sends due within `horizon` seconds are
+    planned; the rest wait for a later run, which plans again from there.
+    """
+
+    def __init__(self, horizon: float = 0.0):
+        self.horizon = horizon
+
+    def plan(self, jobs: List[Any], budget: int, interval: float, start: float = 0.0,
+             priority: Optional[Callable[[Any], Any]] = None) -> List[Tuple[float, Any]]:
+        """(delay in seconds, job) pairs for at most `budget` jobs to send in this run."""
+        key      = priority or (lambda job: 0)
+        # the sequence number keeps equal priorities in their original order
+        heap     = [(key(job), seq, job) for seq, job in enumerate(jobs)]
+        heapq.heapify(heap)
+        planned  = []
+        while heap and len(planned) < budget:
+            delay = start + len(planned) * interval
+            if delay > self.horizon:
+                break
+            planned.append((delay, heapq.heappop(heap)[2]))
+        return planned
+
+
+class AsyncSender:
+    """Runs blocking send calls concurrently on an asyncio loop.
+
+    At most `concurrency` sends are in flight, and they start no faster than the
+    token bucket allows. `on_result(job, result, error)` is called on the loop
+    thread as each send finishes, so bookkeeping there needs no locking.
+
+    Jobs may be given a delay from the start of the run (see SendScheduler);
+    each one is released from a heap of due times once its delay has passed.
+
+    Failures that `classify(error)` reports as transient are retried up to
+    `max_attempts` times with exponential backoff and full jitter. When the
+    provider names a delay (Retry-After), that delay is used instead and the
+    whole bucket pauses for it, so every other send slows down as well.
+    """
+
+    def __init__(self, send: Callable[[Any], Any], rate: float = 1.0, burst: int = 1,
+                 concurrency: int = 4,
+                 classify: Optional[Callable[[Exception], Tuple[bool, Optional[float]]]] = None,
+                 max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.send         = send
+        self.bucket       = TokenBucket(rate, burst)
+        self.concurrency  = max(1, concurrency)
+        self.classify     = classify or (lambda error: (False, None))
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay   = base_delay
+        self.max_delay    = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _send_all(self, jobs: List[Tuple[float, Any]], on_result: Callable[[Any, Any, Optional[Exception]], None]):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        loop  = asyncio.get_running_loop()
+        gate  = asyncio.Semaphore(self.concurrency)
+        start = loop.time()
+
+        async def one(job):
+            for attempt in range(1, self.max_attempts + 1):
+                async with gate:
+                    await self.bucket.acquire()
+                    try:
+                        result = await loop.run_in_executor(pool, self.send, job)
+                    except Exception as e:
+                        error = e
+                    else:
+                        on_result(job, result, None)
+                        return
+                transient, retry_after = self.classify(error)
+                if not transient or attempt == self.max_attempts:
+                    break
+                if retry_after is not None:
+                    # the provider's word wins over max_delay, which only caps our own backoff
+                    delay = retry_after
+                    self.bucket.pause(delay)
+                else:
+                    delay = self.backoff(attempt)
+                print(f"Send failed ({error}); retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s")
+                # wait outside the gate so the slot goes to another send meanwhile
+                await asyncio.sleep(delay)
+            on_result(job, None, error)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="send") as pool:
+            due   = [(delay, seq, job) for seq, (delay, job) in enumerate(jobs)]
+            heapq.heapify(due)
+            tasks = []
+            while due:
+                delay, _, job = heapq.heappop(due)
+                wait = start + delay - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                tasks.append(asyncio.create_task(one(job)))
+            await asyncio.gather(*tasks)
+
+    def run(self, jobs: List[Any], on_result: Callable[[Any, Any, Optional[Exception]], None],
+            delays: Optional[List[float]] = None):
+        """Send every job; `delays[i]`, if given, holds job i back that many seconds."""
+        if jobs:
+            import asyncio
+            asyncio.run(self._send_all(list(zip(delays or [0.0] * len(jobs), jobs)), on_result))
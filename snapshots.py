@@ -0,0 +1,244 @@
+"""Record feed responses over time and replay them to the bot.
+
+    python snapshots.py record feeds.snap.gz URL [URL ...] [--interval 600] [--count 144]
+    python snapshots.py replay feeds.snap.gz [--speed 60] [--port 8098]
+
+`record` polls the feeds and stores every raw response (status, headers, body
+and timings) in a gzip-compressed archive. `replay` serves the archive back
+from a local HTTP server whose clock starts at the first recording and runs
+`speed` times faster than real time: each feed answers with the latest
+response recorded at that point, honoring conditional GETs, so the bot can
+be run against days of real feed history in minutes. bench.py --replay steps
+through an archive poll by poll as fast as the bot can go.
+"""
+import sys
+import json
+import gzip
+import time
+import base64
+import hashlib
+import argparse
+import bisect
+import http.server
+import urllib.request
+import urllib.error
+from typing import Dict, List, Optional
+
+from atomicfile import atomic_write
+from localserver import LocalServer
+
+
+class SnapshotArchive:
+    """Feed responses recorded over time.
+
+    On disk this is one gzip-compressed JSON-lines file. Successive polls of a
+    feed are mostly identical, so each distinct body is stored once, as a
+    {"blob": sha1, "data": base64} line ahead of the first response that uses it;
+    a response line is {"url", "at", "status", "headers", "ttfb", "elapsed", "body": sha1}.
+    """
+
+    def __init__(self):
+        self.responses: Dict[str, List[dict]] = {}
+        self.blobs: Dict[str, bytes] = {}
+
+    @classmethod
+    def load(cls, path: str) -> "SnapshotArchive":
+        archive = cls()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if "blob" in record:
+                    archive.blobs[record["blob"]] = base64.b64decode(record["data"])
+                else:
+                    archive.responses.setdefault(record["url"], []).append(record)
+        for responses in archive.responses.values():
+            responses.sort(key=lambda r: r["at"])
+        return archive
+
+    def save(self, path: str):
+        # a half-written archive never replaces the last good one
+        with atomic_write(path, "wt", opener=gzip.open, encoding="utf-8") as f:
+            written = set()
+            for response in sorted((r for rs in self.responses.values() for r in rs), key=lambda r: r["at"]):
+                blob = response["body"]
+                if blob not in written:
+                    data = base64.b64encode(self.blobs[blob]).decode("ascii")
+                    f.write(json.dumps({"blob": blob, "data": data}) + "\n")
+                    written.add(blob)
+                f.write(json.dumps(response) + "\n")
+
+    def add(self, url: str, at: float, status: int, headers: Dict[str, str], body: bytes,
+            ttfb: float, elapsed: float):
+        blob = hashlib.sha1(body).hexdigest()
+        self.blobs.setdefault(blob, body)
+        self.responses.setdefault(url, []).append({
+            "url": url, "at": at, "status": status, "headers": headers,
+            "ttfb": ttfb, "elapsed": elapsed, "body": blob
+        })
+
+    @property
+    def urls(self) -> List[str]:
+        return list(self.responses)
+
+    def times(self) -> List[float]:
+        """Every moment a poll was recorded, in order."""
+        return sorted({r["at"] for rs in self.responses.values() for r in rs})
+
+    def at(self, url: str, when: float) -> Optional[dict]:
+        """The latest response for `url` recorded at or before `when`."""
+        responses = self.responses.get(url, [])
+        i = bisect.bisect_right(responses, when, key=lambda r: r["at"])
+        return responses[i - 1] if i else None
+
+    def body(self, response: dict) -> bytes:
+        return self.blobs[response["body"]]
+
+
+def record(urls: List[str], path: str, interval: float = 600, count: int = 0,
+           user_agent: str = "NakamaNewsBot/1.0 (+https://github.com/Prodigy-Genes/Anime_Updates)"):
+    """Poll `urls` every `interval` seconds (`count` times, or until interrupted),
+    appending every response to the archive at `path`."""
+    try:
+        archive = SnapshotArchive.load(path)
+    except FileNotFoundError:
+        archive = SnapshotArchive()
+    polls = 0
+    while True:
+        started = time.time()
+        for url in urls:
+            # the bot asks for gzip too; keep the body exactly as it came over the wire
+            req   = urllib.request.Request(url, headers={"User-Agent": user_agent, "Accept-Encoding": "gzip"})
+            begin = time.monotonic()
+            try:
+                resp = urllib.request.urlopen(req, timeout=30)
+            except urllib.error.HTTPError as e:
+                resp = e
+            except OSError as e:
+                print(f"Failed to fetch {url}:", e)
+                continue
+            with resp:
+                ttfb = time.monotonic() - begin
+                body = resp.read()
+                archive.add(url, started, resp.status, dict(resp.headers), body, ttfb, time.monotonic() - begin)
+            print(f"{time.strftime('%H:%M:%S')} {url}: {resp.status}, {len(body)} bytes")
+        archive.save(path)
+        polls += 1
+        if count and polls >= count:
+            return archive
+        time.sleep(max(0.0, started + interval - time.time()))
+
+
+class _ReplayHandler(http.server.BaseHTTPRequestHandler):
+    # hop-by-hop, or written afresh on the way out
+    SKIP_HEADERS = {"transfer-encoding", "connection", "content-length", "keep-alive", "server", "date"}
+
+    def do_GET(self):
+        replay = self.server.replay
+        url    = replay.paths.get(self.path)
+        if url is None:
+            self.send_error(404)
+            return
+        response = replay.archive.at(url, replay.now())
+        if response is None:
+            # nothing recorded this early
+            self.send_error(503)
+            return
+        headers = response["headers"]
+        replay.pause(response["ttfb"])
+        if (self.headers.get("If-None-Match") and self.headers["If-None-Match"] == headers.get("ETag")) or \
+                (self.headers.get("If-Modified-Since") and self.headers["If-Modified-Since"] == headers.get("Last-Modified")):
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = replay.archive.body(response)
+        self.send_response(response["status"])
+        for name, value in headers.items():
+            if name.lower() not in self.SKIP_HEADERS:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # spread the transfer over the recorded download time
+        chunks = 8
+        step   = -(-len(body) // chunks) or 1
+        for i in range(0, len(body), step):
+            try:
+                self.wfile.write(body[i:i + step])
+            except (BrokenPipeError, ConnectionResetError):
+                # the client stopped reading, e.g. the bot reached entries it has seen
+                return
+            replay.pause((response["elapsed"] - response["ttfb"]) / chunks)
+
+    def log_message(self, *args):
+        pass
+
+
+class ReplayServer(LocalServer):
+    """Serves a SnapshotArchive on 127.0.0.1, one path per recorded feed URL (see url_for).
+
+    The replay clock starts at the first recorded poll and runs `speed` times
+    faster than real time; recorded latencies shrink by the same factor. With
+    speed=None the clock only moves when set with `seek`, and responses go out
+    without delay.
+    """
+
+    def __init__(self, archive: SnapshotArchive, speed: Optional[float] = 1.0, port: int = 0):
+        super().__init__(_ReplayHandler, port, replay=self)
+        self.archive = archive
+        self.speed   = speed
+        self.first   = archive.times()[0] if archive.responses else time.time()
+        self.origin  = time.monotonic()
+        self.clock   = self.first
+        self.paths   = {f"/feed/{i}": url for i, url in enumerate(archive.urls)}
+
+    def url_for(self, url: str) -> str:
+        """Where the replay of the recorded feed `url` is served."""
+        return self.base_url + next(path for path, original in self.paths.items() if original == url)
+
+    def now(self) -> float:
+        """The recorded moment being replayed."""
+        if self.speed is None:
+            return self.clock
+        return self.first + (time.monotonic() - self.origin) * self.speed
+
+    def seek(self, when: float):
+        self.clock = when
+
+    def pause(self, seconds: float):
+        if self.speed:
+            time.sleep(seconds / self.speed)
+
+    def start(self) -> str:
+        self.origin = time.monotonic()
+        return super().start()
+
+
+if __name__ == "__main__":
+    parser   = argparse.ArgumentParser(description="Record feed responses over time and replay them to the bot.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rec = commands.add_parser("record", help="poll feeds into an archive")
+    rec.add_argument("archive")
+    rec.add_argument("urls", nargs="+")
+    rec.add_argument("--interval", type=float, default=600, help="seconds between polls (default: 600)")
+    rec.add_argument("--count", type=int, default=0, help="stop after this many polls (default: run until interrupted)")
+    rep = commands.add_parser("replay", help="serve an archive to the bot")
+    rep.add_argument("archive")
+    rep.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded (default: 1)")
+    rep.add_argument("--port", type=int, default=8098)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "record":
+            record(args.urls, args.archive, args.interval, args.count)
+        else:
+            archive = SnapshotArchive.load(args.archive)
+            times   = archive.times()
+            if not times:
+                sys.exit("The archive is empty.")
+            replay  = ReplayServer(archive, args.speed, args.port)
+            print(f"Replaying {len(times)} polls from {time.ctime(times[0])} to {time.ctime(times[-1])} "
+                  f"at {args.speed:g}x; point the bot at:")
+            print("RSS_FEEDS=" + ",".join(replay.url_for(url) for url in archive.urls))
+            replay.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
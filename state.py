@@ -0,0 +1,898 @@
+import os
+import json
+import math
+import calendar
+import mmap
+import bisect
+import time
+import struct
+import hashlib
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from atomicfile import atomic_write
+
+
+class DurableQueue:
+    """Persistent FIFO of JSON payloads for messages that still have to go out."""
+
+    def push(self, payload: dict) -> str:
+        """Append `payload` and return the key that removes it again."""
+        raise NotImplementedError
+
+    def items(self) -> List[Tuple[str, dict]]:
+        """(key, payload) pairs, oldest first."""
+        raise NotImplementedError
+
+    def remove(self, key: str):
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return len(self.items())
+
+
+class FileQueue(DurableQueue):
+    """JSON-lines queue file. Pushes and removals are both appended (a removal is
+    a tombstone line) and the file is rewritten once tombstones outnumber live entries.
+    A last line left half-written by a crash is cut off on load."""
+
+    def __init__(self, path: str):
+        self.path       = path
+        self.entries: Dict[str, dict] = {}
+        self.tombstones = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                lines = f.read().splitlines(keepends=True)
+            if lines and not lines[-1].endswith(b"\n"):
+                # the append that wrote it never finished, so that push or removal never happened
+                with open(path, "r+b") as f:
+                    f.truncate(sum(len(line) for line in lines[:-1]))
+                lines.pop()
+            for line in lines:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("done"):
+                    self.entries.pop(record["key"], None)
+                    self.tombstones += 1
+                else:
+                    self.entries[record["key"]] = record["payload"]
+
+    def _append(self, record: dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def push(self, payload: dict) -> str:
+        import uuid
+        key = uuid.uuid4().hex
+        self._append({"key": key, "payload": payload})
+        self.entries[key] = payload
+        return key
+
+    def items(self) -> List[Tuple[str, dict]]:
+        return list(self.entries.items())
+
+    def remove(self, key: str):
+        if self.entries.pop(key, None) is None:
+            return
+        self._append({"key": key, "done": True})
+        self.tombstones += 1
+        if self.tombstones > len(self.entries):
+            self._rewrite()
+
+    def _rewrite(self):
+        with atomic_write(self.path, fsync=True) as f:
+            for key, payload in self.entries.items():
+                f.write(json.dumps({"key": key, "payload": payload}, ensure_ascii=False) + "\n")
+        self.tombstones = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SQLiteQueue(DurableQueue):
+    """One named queue inside the SQLite state database."""
+
+    def __init__(self, store: "SQLiteStateStore", name: str):
+        self.store = store
+        self.name  = name
+
+    def push(self, payload: dict) -> str:
+        with self.store.lock:
+            cur = self.store.conn.execute(
+                "INSERT INTO queue (name, payload, created) VALUES (?, ?, ?)",
+                (self.name, json.dumps(payload, ensure_ascii=False), time.time()))
+        return str(cur.lastrowid)
+
+    def items(self) -> List[Tuple[str, dict]]:
+        with self.store.lock:
+            rows = self.store.conn.execute(
+                "SELECT id, payload FROM queue WHERE name = ? ORDER BY id", (self.name,)).fetchall()
+        return [(str(key), json.loads(payload)) for key, payload in rows]
+
+    def remove(self, key: str):
+        with self.store.lock:
+            self.store.conn.execute("DELETE FROM queue WHERE id = ? AND name = ?", (int(key), self.name))
+
+    def __len__(self) -> int:
+        with self.store.lock:
+            return self.store.conn.execute("SELECT count(*) FROM queue WHERE name = ?", (self.name,)).fetchone()[0]
+
+
+class StateStore:
+    """Everything the bot remembers between runs: seen entry IDs, recent send
+    times for the rolling quota and a history of sends.
+
+    Seen IDs support `uid in store` / `store.add(uid)`; additions are buffered
+    and only persisted by `flush()`, at the end of a run. Each seen ID carries
+    the time it was last observed in a feed (`touch`); with a `ttl`, IDs not
+    observed for that long are dropped on flush.
+    """
+    # a re-observed ID is only re-stamped when its timestamp is older than this
+    TOUCH_INTERVAL = 24 * 3600
+
+    def __contains__(self, uid: str) -> bool:
+        raise NotImplementedError
+
+    def add(self, uid: str):
+        raise NotImplementedError
+
+    def touch(self, uid: str):
+        """Note that an already-seen ID is still present in a feed."""
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever new seen IDs are persisted, so something kept beside the
+        store (a Bloom filter) can tell that IDs were added without it."""
+        raise NotImplementedError
+
+    def load_send_times(self, since: float) -> List[float]:
+        """Times of the successful sends at or after `since`, oldest first."""
+        raise NotImplementedError
+
+    def record_sent(self, at: float, since: float):
+        """Remember a successful send at `at`; sends before `since` may be forgotten."""
+        raise NotImplementedError
+
+    def record_send(self, to: str, title: str, link: str, sid: Optional[str], status: str):
+        raise NotImplementedError
+
+    def queue(self, name: str) -> DurableQueue:
+        """The persistent message queue called `name` (e.g. "dead_letter")."""
+        raise NotImplementedError
+
+    def acquire_lease(self, ttl: float) -> bool:
+        """Take the right to poll and send for the next `ttl` seconds; False while
+        another process holds it. Only a store meant to be shared between processes
+        (SQLite) ever says no; the file backends assume a single process."""
+        return True
+
+    def release_lease(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileBackedStore(StateStore):
+    """What the file backends share: send times in send_times.json, a
+    send_history.jsonl log and one JSON-lines file per queue. Subclasses keep the
+    seen IDs, in the files named by `seen_files`.
+    """
+
+    def __init__(self, seen_files: Tuple[str, ...], times_file: str = "send_times.json",
+                 history_file: str = "send_history.jsonl", ttl: Optional[float] = None):
+        self.seen_files   = seen_files
+        self.times_file   = times_file
+        self.history_file = history_file
+        self.ttl          = ttl
+
+    @property
+    def generation(self) -> int:
+        # every write to a seen-ID file changes its size or mtime
+        stamp = []
+        for path in self.seen_files:
+            st = os.stat(path) if os.path.exists(path) else None
+            stamp += [st.st_size, st.st_mtime_ns] if st else [0, 0]
+        return int.from_bytes(hashlib.blake2b(repr(stamp).encode("ascii"), digest_size=8).digest(), "big")
+
+    def load_send_times(self, since: float) -> List[float]:
+        if os.path.exists(self.times_file):
+            with open(self.times_file, "r") as f:
+                return [t for t in json.load(f) if t >= since]
+        if os.path.exists("daily_count.json"):
+            # the old per-day counter: its sends count from midnight UTC of that day,
+            # so they stop counting when the old counter would have reset
+            with open("daily_count.json", "r") as f:
+                data = json.load(f)
+            day = calendar.timegm(time.strptime(data.get("date", "1970-01-01"), "%Y-%m-%d"))
+            return [day] * data.get("count", 0) if day >= since else []
+        return []
+
+    def record_sent(self, at: float, since: float):
+        times = self.load_send_times(since) + [at]
+        with atomic_write(self.times_file) as f:
+            json.dump(times, f)
+
+    def record_send(self, to: str, title: str, link: str, sid: Optional[str], status: str):
+        row = {"sent_at": time.time(), "to": to, "title": title, "link": link,
+               "sid": sid, "status": status}
+        with open(self.history_file, "a") as f:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def queue(self, name: str) -> DurableQueue:
+        return FileQueue(f"{name}.jsonl")
+
+
+class FileStateStore(FileBackedStore):
+    """Plain files: a seen-ID snapshot plus append-only journal, send_times.json
+    and a send_history.jsonl log.
+
+    Seen-ID lines are "<uid>\t<last seen epoch>"; a later journal line for the
+    same uid supersedes earlier ones. Lines without a timestamp (older files)
+    count as seen at load time.
+    """
+
+    def __init__(self, seen_file: str = "seen_ids.txt", journal_file: str = "seen_ids.journal",
+                 times_file: str = "send_times.json", history_file: str = "send_history.jsonl",
+                 compact_threshold: int = 500, ttl: Optional[float] = None):
+        super().__init__((seen_file, journal_file), times_file, history_file, ttl)
+        self.seen_file         = seen_file
+        self.journal_file      = journal_file
+        self.compact_threshold = compact_threshold
+        self.journal_len       = 0
+        self.expired           = 0
+        self.new_seen: List[Tuple[str, float]] = []
+        self.seen: Dict[str, float] = self._load_seen()
+
+    def _read_lines(self, path: str, seen: Dict[str, float], now: float) -> int:
+        count = 0
+        with open(path, "r") as f:
+            for line in f:
+                uid, _, ts = line.rstrip("\n").partition("\t")
+                if uid:
+                    seen[uid] = float(ts) if ts else now
+                    count += 1
+        return count
+
+    def _load_seen(self) -> Dict[str, float]:
+        # seen IDs = compacted snapshot + IDs appended to the journal since then
+        now  = time.time()
+        seen = {}
+        if os.path.exists(self.seen_file):
+            self._read_lines(self.seen_file, seen, now)
+        if os.path.exists(self.journal_file):
+            self.journal_len = self._read_lines(self.journal_file, seen, now)
+        if self.ttl:
+            cutoff = now - self.ttl
+            live   = {uid: ts for uid, ts in seen.items() if ts >= cutoff}
+            # expired IDs linger on disk until the next compaction
+            self.expired = len(seen) - len(live)
+            seen = live
+        return seen
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self.seen
+
+    def iter_seen(self) -> Iterator[str]:
+        """Every persisted seen ID, in no particular order."""
+        return iter(self.seen)
+
+    def add(self, uid: str):
+        if uid not in self.seen:
+            now = time.time()
+            self.seen[uid] = now
+            self.new_seen.append((uid, now))
+
+    def touch(self, uid: str):
+        now = time.time()
+        if now - self.seen.get(uid, now) > self.TOUCH_INTERVAL:
+            self.seen[uid] = now
+            self.new_seen.append((uid, now))
+
+    def flush(self):
+        # append only what is new this run; cost is proportional to new items, not history
+        if self.new_seen:
+            with open(self.journal_file, "a") as f:
+                f.write("".join(f"{uid}\t{ts:.0f}\n" for uid, ts in self.new_seen))
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_len += len(self.new_seen)
+            self.new_seen = []
+        if self.journal_len + self.expired >= self.compact_threshold:
+            self.compact()
+
+    def compact(self):
+        if self.ttl:
+            cutoff    = time.time() - self.ttl
+            self.seen = {uid: ts for uid, ts in self.seen.items() if ts >= cutoff}
+        # write the new snapshot aside and swap it in atomically before dropping the journal;
+        # a crash in between only leaves duplicates, which loading tolerates
+        with atomic_write(self.seen_file, fsync=True) as f:
+            for uid in sorted(self.seen):
+                f.write(f"{uid}\t{self.seen[uid]:.0f}\n")
+        open(self.journal_file, "w").close()
+        self.journal_len = 0
+        self.expired     = 0
+
+
+class HashedIndex:
+    """Seen IDs as a sorted array of fixed-width records (64-bit blake2b hash of
+    the ID, last-seen epoch) in a memory-mapped file.
+
+    Lookups bisect the mapped array directly, so opening reads nothing and each
+    entry costs 12 bytes on disk instead of a full URL string in a Python set.
+    """
+    MAGIC  = b"NKHX"
+    HEADER = struct.Struct(">4sIQ")  # magic, format version, time of last expiry sweep
+    RECORD = struct.Struct(">QI")    # ID hash, last seen
+
+    def __init__(self, path: str):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, 1, 0))
+        self.file = open(path, "r+b")
+        self._map()
+
+    def _map(self):
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, _, self.last_sweep = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{self.path} is not a seen-ID index file")
+        self.size = (len(self.map) - self.HEADER.size) // self.RECORD.size
+
+    def _resize(self, records: int):
+        self.map.close()
+        self.file.truncate(self.HEADER.size + records * self.RECORD.size)
+        self._map()
+
+    @staticmethod
+    def hash(uid: str) -> int:
+        return int.from_bytes(hashlib.blake2b(uid.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> int:
+        # the hash at position i, which lets bisect search the mapped array as a sequence
+        return self.RECORD.unpack_from(self.map, self.HEADER.size + i * self.RECORD.size)[0]
+
+    def find(self, h: int) -> int:
+        i = bisect.bisect_left(self, h, 0, self.size)
+        return i if i < self.size and self[i] == h else -1
+
+    def last_seen(self, i: int) -> int:
+        return self.RECORD.unpack_from(self.map, self.HEADER.size + i * self.RECORD.size)[1]
+
+    def stamp(self, i: int, ts: float):
+        self.RECORD.pack_into(self.map, self.HEADER.size + i * self.RECORD.size, self[i], int(ts))
+
+    def merge(self, new: Dict[int, float]):
+        """Insert hashes not yet present, in place: grow the file, then walk the new
+        hashes from largest to smallest, shifting each run of existing records right
+        with one memmove and dropping the new record into the gap."""
+        fresh = sorted(h for h in new if self.find(h) < 0)
+        if not fresh:
+            return
+        base, width = self.HEADER.size, self.RECORD.size
+        hi = self.size
+        self._resize(self.size + len(fresh))
+        for j in range(len(fresh) - 1, -1, -1):
+            h = fresh[j]
+            p = bisect.bisect_left(self, h, 0, hi)
+            # records [p, hi) are larger than h; j smaller new hashes still go in before them
+            if hi > p:
+                self.map.move(base + (p + j + 1) * width, base + p * width, (hi - p) * width)
+            self.RECORD.pack_into(self.map, base + (p + j) * width, h, int(new[h]))
+            hi = p
+
+    def sweep(self, cutoff: float):
+        """Drop records last seen before `cutoff`, compacting the array in place."""
+        base, width = self.HEADER.size, self.RECORD.size
+        keep = 0
+        for i in range(self.size):
+            src = base + i * width
+            if self.RECORD.unpack_from(self.map, src)[1] >= cutoff:
+                if keep != i:
+                    self.map.move(base + keep * width, src, width)
+                keep += 1
+        self._resize(keep)
+        self.last_sweep = int(time.time())
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, 1, self.last_sweep)
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+
+class HashedStateStore(FileBackedStore):
+    """File backend with seen IDs kept in a HashedIndex (seen_ids.idx) instead of
+    the text snapshot and journal. Send times and history are unchanged.
+
+    Only hashes are stored, so unlike the other stores this one has no
+    `iter_seen`: the original IDs cannot be listed back out.
+    """
+    # expired records are swept out at most this often; the sweep rewrites the whole array
+    SWEEP_INTERVAL = 24 * 3600
+
+    def __init__(self, index_file: str = "seen_ids.idx", times_file: str = "send_times.json",
+                 history_file: str = "send_history.jsonl", ttl: Optional[float] = None):
+        super().__init__((index_file,), times_file, history_file, ttl)
+        fresh = not os.path.exists(index_file)
+        self.index = HashedIndex(index_file)
+        self.pending: Dict[int, float] = {}
+        if fresh and (os.path.exists("seen_ids.txt") or os.path.exists("seen_ids.journal")):
+            # first run on the index: carry over the text snapshot and journal
+            legacy = FileStateStore(ttl=ttl)
+            self.index.merge({HashedIndex.hash(uid): ts for uid, ts in legacy.seen.items()})
+            self.index.flush()
+
+    def __contains__(self, uid: str) -> bool:
+        h = HashedIndex.hash(uid)
+        return h in self.pending or self.index.find(h) >= 0
+
+    def add(self, uid: str):
+        self.pending.setdefault(HashedIndex.hash(uid), time.time())
+
+    def touch(self, uid: str):
+        i   = self.index.find(HashedIndex.hash(uid))
+        now = time.time()
+        if i >= 0 and now - self.index.last_seen(i) > self.TOUCH_INTERVAL:
+            self.index.stamp(i, now)
+
+    def flush(self):
+        if self.pending:
+            self.index.merge(self.pending)
+            self.pending = {}
+        now = time.time()
+        if self.ttl and now - self.index.last_sweep > self.SWEEP_INTERVAL:
+            self.index.sweep(now - self.ttl)
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        self.index.close()
+
+
+class SQLiteStateStore(StateStore):
+    """All state in one SQLite database in WAL mode.
+
+    Seen IDs are looked up through the primary-key index instead of being loaded
+    into memory, and writes are transactional. Several bot processes can share
+    one database: a run lease (one row in `lease`) lets one of them at a time
+    poll, queue and send, so none of them sends what another already queued or
+    sent, or spends quota another already used. A lease left by a crashed
+    process expires. Send times come straight from send_history.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS seen (
+            uid        TEXT PRIMARY KEY,
+            first_seen REAL NOT NULL,
+            last_seen  REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS seen_last_seen ON seen (last_seen);
+        CREATE TABLE IF NOT EXISTS send_history (
+            id        INTEGER PRIMARY KEY,
+            sent_at   REAL NOT NULL,
+            recipient TEXT,
+            title     TEXT,
+            link      TEXT,
+            sid       TEXT,
+            status    TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS send_history_sent_at ON send_history (sent_at);
+        CREATE TABLE IF NOT EXISTS queue (
+            id      INTEGER PRIMARY KEY,
+            name    TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS queue_name ON queue (name, id);
+        CREATE TABLE IF NOT EXISTS lease (
+            id      INTEGER PRIMARY KEY CHECK (id = 1),
+            holder  TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str = "state.db", ttl: Optional[float] = None):
+        self.path = path
+        self.ttl  = ttl
+        # feed downloads check membership from worker threads, so share one connection under a lock
+        import sqlite3
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.pending: Set[str] = set()
+        self.touched: Set[str] = set()
+        import uuid
+        # who holds the run lease, as "<pid>-<random>"
+        self.holder = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def __contains__(self, uid: str) -> bool:
+        if uid in self.pending:
+            return True
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM seen WHERE uid = ?", (uid,)).fetchone()
+        return row is not None
+
+    def add(self, uid: str):
+        self.pending.add(uid)
+
+    def touch(self, uid: str):
+        self.touched.add(uid)
+
+    def add_many(self, uids):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR IGNORE INTO seen (uid, first_seen, last_seen) VALUES (?, ?, ?)",
+                                  ((uid, now, now) for uid in uids))
+            # user_version serves as the generation counter
+            generation = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            self.conn.execute(f"PRAGMA user_version = {(generation + 1) % 2 ** 31}")
+            self.conn.execute("COMMIT")
+
+    @property
+    def generation(self) -> int:
+        with self.lock:
+            return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def flush(self):
+        if self.pending:
+            self.add_many(self.pending)
+            self.pending = set()
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if self.touched:
+                self.conn.executemany(
+                    "UPDATE seen SET last_seen = ? WHERE uid = ? AND last_seen < ?",
+                    ((now, uid, now - self.TOUCH_INTERVAL) for uid in self.touched))
+                self.touched = set()
+            if self.ttl:
+                self.conn.execute("DELETE FROM seen WHERE last_seen < ?", (now - self.ttl,))
+            self.conn.execute("COMMIT")
+
+    def iter_seen(self) -> Iterator[str]:
+        """Every persisted seen ID, in no particular order."""
+        for (uid,) in self.conn.cursor().execute("SELECT uid FROM seen"):
+            yield uid
+
+    def load_send_times(self, since: float) -> List[float]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT sent_at FROM send_history WHERE sent_at >= ? AND status = 'sent' ORDER BY sent_at",
+                (since,)).fetchall()
+        return [row[0] for row in rows]
+
+    def record_sent(self, at: float, since: float):
+        # the "sent" row record_send() writes is the send time
+        pass
+
+    def record_send(self, to: str, title: str, link: str, sid: Optional[str], status: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO send_history (sent_at, recipient, title, link, sid, status) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (time.time(), to, title, link, sid, status))
+
+    def queue(self, name: str) -> DurableQueue:
+        return SQLiteQueue(self, name)
+
+    def acquire_lease(self, ttl: float) -> bool:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row  = self.conn.execute("SELECT holder, expires FROM lease WHERE id = 1").fetchone()
+            free = row is None or row[0] == self.holder or row[1] < now
+            if free:
+                self.conn.execute("INSERT OR REPLACE INTO lease (id, holder, expires) VALUES (1, ?, ?)",
+                                  (self.holder, now + ttl))
+            self.conn.execute("COMMIT")
+        return free
+
+    def release_lease(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM lease WHERE id = 1 AND holder = ?", (self.holder,))
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class SendWindow:
+    """Rolling quota of `limit` sends per `window` seconds.
+
+    The last `limit` send times sit in a ring buffer. The slot about to be
+    overwritten holds the oldest of them, so whether another send fits
+    (`allows`) and how long until one does (`wait`) take a single lookup;
+    only `remaining`, which sizes a whole batch, walks the ring.
+    """
+
+    def __init__(self, limit: int, window: float, times: List[float] = ()):
+        self.limit  = max(1, limit)
+        self.window = window
+        self.ring   = [-math.inf] * self.limit
+        self.head   = 0
+        for at in sorted(times)[-self.limit:]:
+            self.record(at)
+
+    def record(self, at: float):
+        self.ring[self.head] = at
+        self.head = (self.head + 1) % self.limit
+
+    @property
+    def last(self) -> float:
+        """Time of the latest send, or -inf before any."""
+        return self.ring[self.head - 1]
+
+    def allows(self, now: float) -> bool:
+        """Whether another send fits in the window ending at `now`."""
+        return self.ring[self.head] <= now - self.window
+
+    def remaining(self, now: float) -> int:
+        """Sends that still fit in the window ending at `now`."""
+        cutoff = now - self.window
+        return sum(1 for at in self.ring if at <= cutoff)
+
+    def wait(self, now: float) -> float:
+        """Seconds until another send fits."""
+        return max(0.0, self.ring[self.head] + self.window - now)
+
+
+class RejectedCache:
+    """IDs of entries the keyword filter turned down, so later polls can skip them
+    without filtering again. Entries expire after `ttl` seconds, and the whole
+    cache is dropped when `fingerprint` (a digest of the filter) changes.
+    """
+
+    def __init__(self, path: str = "rejected_ids.json", ttl: float = 7 * 86400, fingerprint: str = ""):
+        self.path        = path
+        self.ttl         = ttl
+        self.fingerprint = fingerprint
+        self.ids: Dict[str, float] = {}
+        self.dirty       = False
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("fingerprint") == fingerprint:
+                cutoff   = time.time() - ttl
+                self.ids = {uid: ts for uid, ts in data.get("ids", {}).items() if ts >= cutoff}
+            self.dirty = len(self.ids) != len(data.get("ids", {}))
+
+    def __contains__(self, uid: str) -> bool:
+        # a long-running daemon outlives the TTL, so it is checked on every lookup too
+        added = self.ids.get(uid)
+        return added is not None and added >= time.time() - self.ttl
+
+    def add(self, uid: str):
+        self.ids[uid] = time.time()
+        self.dirty    = True
+
+    def flush(self):
+        cutoff = time.time() - self.ttl
+        live   = {uid: ts for uid, ts in self.ids.items() if ts >= cutoff}
+        if len(live) != len(self.ids):
+            self.ids   = live
+            self.dirty = True
+        if not self.dirty:
+            return
+        with atomic_write(self.path) as f:
+            json.dump({"fingerprint": self.fingerprint, "ids": self.ids}, f)
+        self.dirty = False
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter kept in a binary file and memory-mapped.
+
+    Opening costs the same whatever the history length: nothing is read up
+    front, pages are faulted in as bits are probed. Sized for `capacity` IDs at
+    false-positive rate `fp_rate`; beyond capacity the rate degrades, which
+    `saturated` reports so the caller can rebuild a larger one.
+    """
+    MAGIC  = b"NKBF"
+    # magic, bit count, hash count, capacity, items added, generation of the store it mirrors
+    HEADER = struct.Struct("<4sQIQQQ")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "r+b")
+        self.map  = mmap.mmap(self.file.fileno(), 0)
+        magic, self.nbits, self.nhashes, self.capacity, self.count, self.generation = \
+            self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a Bloom filter file")
+
+    @classmethod
+    def create(cls, path: str, capacity: int, fp_rate: float) -> "BloomFilter":
+        nbits   = max(64, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        nhashes = max(1, round(nbits / capacity * math.log(2)))
+        with atomic_write(path, "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, nbits, nhashes, capacity, 0, 0))
+            f.truncate(cls.HEADER.size + (nbits + 7) // 8)
+        return cls(path)
+
+    def _positions(self, uid: str) -> Iterator[int]:
+        # double hashing: k probes derived from two 64-bit halves of one digest
+        digest = hashlib.blake2b(uid.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        for i in range(self.nhashes):
+            yield (h1 + i * h2) % self.nbits
+
+    def __contains__(self, uid: str) -> bool:
+        base = self.HEADER.size
+        return all(self.map[base + pos // 8] & (1 << (pos % 8)) for pos in self._positions(uid))
+
+    def add(self, uid: str):
+        base = self.HEADER.size
+        for pos in self._positions(uid):
+            self.map[base + pos // 8] |= 1 << (pos % 8)
+        self.count += 1
+
+    @property
+    def saturated(self) -> bool:
+        return self.count > self.capacity
+
+    def flush(self):
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, self.nbits, self.nhashes, self.capacity, self.count,
+                              self.generation)
+        self.map.flush()
+
+    def close(self, flush: bool = True):
+        # flush=False leaves the file as another process may have written it
+        if flush:
+            self.flush()
+        self.map.close()
+        self.file.close()
+
+
+class BloomFilteredStore(StateStore):
+    """Puts a persisted Bloom filter in front of another store's seen IDs.
+
+    A miss in the filter is a definite "new"; only filter hits are confirmed
+    against the exact store, which must be able to list its IDs (`iter_seen`:
+    the file or SQLite store) so the filter can be rebuilt. Paired with the SQLite backend this keeps memory
+    and startup flat no matter how many IDs have been seen.
+
+    The filter records the store's generation as of its last flush. A filter
+    that no longer matches (the store was used without it for a while) would
+    miss IDs added meanwhile, so it is rebuilt on open.
+    """
+
+    def __init__(self, inner: StateStore, path: str = "seen.bloom",
+                 capacity: int = 1_000_000, fp_rate: float = 0.001):
+        self.inner    = inner
+        self.path     = path
+        self.fp_rate  = fp_rate
+        self.capacity = capacity
+        self.bloom    = None
+        self._sync()
+
+    def _sync(self):
+        """(Re)open the filter file, rebuilding it unless it matches the store."""
+        capacity = self.capacity
+        if self.bloom is not None:
+            # another process sharing the store may have updated or replaced the file since
+            self.bloom.close(flush=False)
+        self.bloom = BloomFilter(self.path) if os.path.exists(self.path) else None
+        if self.bloom is None or self.bloom.generation != self.inner.generation:
+            if self.bloom is not None:
+                capacity = max(capacity, self.bloom.capacity)
+                self.bloom.close()
+            self.bloom = self._rebuild(capacity)
+
+    def _rebuild(self, capacity: int) -> BloomFilter:
+        while True:
+            bloom = BloomFilter.create(self.path, capacity, self.fp_rate)
+            for uid in self.inner.iter_seen():
+                bloom.add(uid)
+            if not bloom.saturated:
+                break
+            # more IDs than expected: size for twice what is there now
+            capacity = bloom.count * 2
+            bloom.close()
+        bloom.generation = self.inner.generation
+        bloom.flush()
+        return bloom
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self.bloom and uid in self.inner
+
+    def add(self, uid: str):
+        self.bloom.add(uid)
+        self.inner.add(uid)
+
+    def touch(self, uid: str):
+        # expired IDs stay set in the filter; they just become false positives
+        self.inner.touch(uid)
+
+    def flush(self):
+        # the filter must never lag the exact store, or seen IDs would read as new;
+        # a crash between the two flushes leaves a stale generation, so the next open rebuilds
+        self.bloom.flush()
+        self.inner.flush()
+        self.bloom.generation = self.inner.generation
+        self.bloom.flush()
+        if self.bloom.saturated:
+            capacity = self.bloom.count * 2
+            self.bloom.close()
+            self.bloom = self._rebuild(capacity)
+
+    def iter_seen(self) -> Iterator[str]:
+        return self.inner.iter_seen()
+
+    def load_send_times(self, since: float) -> List[float]:
+        return self.inner.load_send_times(since)
+
+    def record_sent(self, at: float, since: float):
+        self.inner.record_sent(at, since)
+
+    def record_send(self, to: str, title: str, link: str, sid: Optional[str], status: str):
+        self.inner.record_send(to, title, link, sid, status)
+
+    def queue(self, name: str) -> DurableQueue:
+        return self.inner.queue(name)
+
+    def acquire_lease(self, ttl: float) -> bool:
+        if not self.inner.acquire_lease(ttl):
+            return False
+        # pick up what other processes added while they held the lease
+        self._sync()
+        return True
+
+    def release_lease(self):
+        self.inner.release_lease()
+
+    def close(self):
+        self.flush()
+        self.bloom.close()
+        self.inner.close()
+
+
+def open_state(backend: str = "file", db_path: str = "state.db", seen_filter: str = "",
+               bloom_capacity: int = 1_000_000, bloom_fp_rate: float = 0.001,
+               ttl: Optional[float] = None) -> StateStore:
+    """Open the configured state backend ("file", "hashed" or "sqlite"), optionally
+    behind a Bloom filter (seen_filter="bloom"). Seen IDs not observed for `ttl`
+    seconds expire."""
+    if backend == "file":
+        store = FileStateStore(ttl=ttl)
+    elif backend == "hashed":
+        if seen_filter:
+            raise ValueError("the hashed backend is already compact; it does not take a seen filter")
+        store = HashedStateStore(ttl=ttl)
+    elif backend == "sqlite":
+        fresh = not os.path.exists(db_path)
+        store = SQLiteStateStore(db_path, ttl=ttl)
+        if fresh and os.path.exists("seen_ids.idx"):
+            # the hashed index cannot be carried over (any seen_ids.txt beside it is older),
+            # and starting empty would resend everything
+            store.close()
+            os.remove(db_path)
+            raise ValueError("seen_ids.idx only holds ID hashes and cannot be imported into SQLite; "
+                             "stay on STATE_BACKEND=hashed, or move seen_ids.idx aside to start afresh")
+        if fresh and (os.path.exists("seen_ids.txt") or os.path.exists("seen_ids.journal")):
+            # first run on SQLite: carry over the history kept by the file backend
+            store.add_many(FileStateStore().iter_seen())
+    else:
+        raise ValueError(f"Unknown state backend: {backend!r}")
+
+    if seen_filter == "bloom":
+        return BloomFilteredStore(store, capacity=bloom_capacity, fp_rate=bloom_fp_rate)
+    if seen_filter:
+        raise ValueError(f"Unknown seen filter: {seen_filter!r}")
+    return store
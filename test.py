@@ -4,6 +4,9 @@ from dotenv import load_dotenv # type: ignore
 
 load_dotenv()
 client = Client(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
+# TWILIO_API_BASE_URL=http://127.0.0.1:8099 sends to fake_twilio.py instead of the real API
+if os.getenv("TWILIO_API_BASE_URL"):
+    client.api.base_url = os.getenv("TWILIO_API_BASE_URL").rstrip("/")
 
 message = client.messages.create(
     from_=os.getenv("TWILIO_WHATSAPP_FROM"),